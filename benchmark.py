@@ -0,0 +1,393 @@
+"""
+Benchmark the BA -> Design -> Developer -> Tester -> Project Lead pipeline against a local
+stub inference server, so runs are deterministic and free.
+
+    python benchmark.py --latency 0.2 --chars-per-second 2000 --output bench.json
+    python benchmark.py --baseline bench.json --tolerance 0.2
+
+Reports per-stage wall time, LLM calls, prompt/completion tokens, ChromaDB write and query
+latency and peak RSS as JSON. With --baseline, exits with status 1 if any stage regressed.
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+REQUIREMENTS = """
+Build a library management system. Members can search the catalogue, borrow and return books,
+and reserve titles that are on loan. Librarians manage the catalogue and member accounts.
+Overdue loans accrue fines, and members are notified by email before a loan is due.
+"""
+
+CHAT_QUESTIONS = [
+    "What is the pass rate of the tests?",
+    "Which files implement the borrowing workflow?",
+    "Summarise the architecture in two sentences."
+]
+
+
+def estimate_tokens(text):
+    # Same estimate prompt_builder uses without a tokenizer
+    return len(text) // 4 + 1 if text else 0
+
+
+class StubLLM:
+    """
+    Deterministic fake completions: recognises each agent's prompt and answers in the shape
+    that agent parses. Free-text answers are padded to response_chars.
+    """
+
+    def __init__(self, stories=5, files=4, response_chars=2000):
+        self.stories = stories
+        self.files = files
+        self.response_chars = response_chars
+
+    def complete(self, prompt):
+        if "senior Business Analyst" in prompt:
+            return self._stories()
+        if "identify all the Python files" in prompt:
+            return self._file_plan()
+        if "You need to implement the following files:" in prompt:
+            section = prompt.split("You need to implement the following files:")[1].split("\n\n")[0]
+            filenames = re.findall(r"^- (\S+)", section, re.MULTILINE)
+            return "\n\n".join(f"### FILE: {name}\n```python\n{self._code(name)}```" for name in filenames)
+        if "You need to implement the file:" in prompt:
+            filename = prompt.split("You need to implement the file:")[1].split()[0]
+            return f"```python\n{self._code(filename)}```"
+        if "Software Architect" in prompt:
+            return self._design()
+        if "creating comprehensive test cases" in prompt:
+            return self._test_cases()
+        if "executing test cases" in prompt:
+            return self._test_results(re.findall(r"^Test #\d+: (.+)$", prompt, re.MULTILINE))
+        if "writing automated acceptance tests" in prompt:
+            count = len(re.findall(r"^Test #\d+: ", prompt, re.MULTILINE))
+            body = "".join(f"def test_case_{i+1}():\n    assert True\n\n" for i in range(count))
+            return f"```python\n{body}```"
+        return self._pad("The project is on track. ")
+
+    def _pad(self, text, line=""):
+        filler = line or "Lorem ipsum dolor sit amet, consectetur adipiscing elit. "
+        while len(text) < self.response_chars:
+            text += filler
+        return text
+
+    def _stories(self):
+        return json.dumps([
+            {
+                "title": f"Feature {i+1}",
+                "role": "member",
+                "want": f"to use feature {i+1}",
+                "so_that": "I can manage my loans",
+                "acceptance_criteria": [f"Feature {i+1} works", "Errors are reported"]
+            }
+            for i in range(self.stories)
+        ], indent=2)
+
+    def _file_plan(self):
+        return json.dumps([
+            {"filename": f"module_{i+1}.py", "stories": [i % self.stories + 1], "sections": ["Architecture"]}
+            for i in range(self.files)
+        ])
+
+    def _design(self):
+        sections = ["Architecture", "Data Model", "API", "Security"]
+        return self._pad("".join(f"## {name}\n{name} overview.\n\n" for name in sections))
+
+    def _code(self, filename):
+        name = re.sub(r"\W", "_", filename.rsplit(".", 1)[0])
+        code = f'def {name}():\n    """Entry point of {filename}"""\n    return True\n\n'
+        return self._pad(code, "# padding line for response size\n")
+
+    def _test_cases(self):
+        return json.dumps([
+            {
+                "title": f"Test feature {i+1}",
+                "description": f"Verify feature {i+1}",
+                "steps": ["Open the app", f"Use feature {i+1}"],
+                "expected_result": "The feature works"
+            }
+            for i in range(self.stories)
+        ], indent=2)
+
+    def _test_results(self, titles):
+        return json.dumps([
+            {"title": title, "description": "", "status": "FAIL" if i % 4 == 3 else "PASS", "details": ""}
+            for i, title in enumerate(titles)
+        ], indent=2)
+
+
+class StubServer:
+    """
+    OpenAI-compatible /v1/completions endpoint (plain and SSE streaming) with simulated
+    time-to-first-token latency and generation speed. Counts calls and tokens.
+    """
+
+    def __init__(self, llm, latency=0.0, chars_per_second=0.0):
+        self.llm = llm
+        self.latency = latency
+        self.chars_per_second = chars_per_second
+        self.counters = {"llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def _record(self, prompt, text):
+        with self._lock:
+            self.counters["llm_calls"] += 1
+            self.counters["prompt_tokens"] += estimate_tokens(prompt)
+            self.counters["completion_tokens"] += estimate_tokens(text)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                text = server.llm.complete(body["prompt"])
+                server._record(body["prompt"], text)
+                time.sleep(server.latency)
+
+                if not body.get("stream"):
+                    self._sleep_for(text)
+                    self._send(200, "application/json", json.dumps({"choices": [{"text": text}]}).encode("utf-8"))
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for start in range(0, len(text), 64):
+                    chunk = text[start:start + 64]
+                    self._sleep_for(chunk)
+                    event = json.dumps({"choices": [{"text": chunk}]})
+                    self.wfile.write(f"data: {event}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+            def _sleep_for(self, text):
+                if server.chars_per_second:
+                    time.sleep(len(text) / server.chars_per_second)
+
+            def _send(self, status, content_type, payload):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize_ms(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.mean(ordered), 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+        "max_ms": round(ordered[-1], 2)
+    }
+
+
+def run_pipeline(server, project_name):
+    """
+    One end-to-end pass through every agent. Returns per-stage metrics and DB latencies.
+    """
+    from agents.business_analyst import BusinessAnalyst
+    from agents.design_agent import DesignAgent
+    from agents.developer_agent import Developer
+    from agents.testing_agent import Tester
+    from agents.project_lead import ProjectLead
+    from utils.registry import get_agent, get_db_manager
+
+    db = get_db_manager()
+    artifacts = {}
+    stages = {}
+    db_writes = []
+    db_queries = []
+
+    def stage(name, fn):
+        before = server.snapshot()
+        start = time.perf_counter()
+        result = fn()
+        elapsed = (time.perf_counter() - start) * 1000
+        after = server.snapshot()
+        stages[name] = {"wall_ms": round(elapsed, 2)}
+        stages[name].update({key: after[key] - before[key] for key in after})
+        return result
+
+    def store(name):
+        start = time.perf_counter()
+        db.store_artifact(project_name, name, artifacts[name])
+        db_writes.append((time.perf_counter() - start) * 1000)
+
+    artifacts["requirements"] = REQUIREMENTS
+    store("requirements")
+    artifacts["user_stories"] = stage("user_stories", lambda: get_agent(BusinessAnalyst).generate_user_stories(REQUIREMENTS))
+    store("user_stories")
+    artifacts["design_doc"] = stage("design_doc", lambda: get_agent(DesignAgent).create_design(REQUIREMENTS, artifacts["user_stories"]))
+    store("design_doc")
+    artifacts["code_traceability"] = {}
+    artifacts["code"] = stage("code", lambda: get_agent(Developer).generate_code(
+        artifacts["user_stories"], artifacts["design_doc"], traceability=artifacts["code_traceability"]
+    ))
+    store("code")
+    artifacts["test_cases"] = stage("test_cases", lambda: get_agent(Tester).create_test_cases(
+        artifacts["user_stories"], artifacts["design_doc"], artifacts["code"]
+    ))
+    store("test_cases")
+    artifacts["test_results"] = stage("test_results", lambda: get_agent(Tester).execute_tests(
+        artifacts["test_cases"], artifacts["code"]
+    ))
+    store("test_results")
+
+    project_lead = get_agent(ProjectLead)
+    stage("chat", lambda: [
+        project_lead.respond(question, project_name, REQUIREMENTS, artifacts)
+        for question in CHAT_QUESTIONS
+    ])
+
+    for question in CHAT_QUESTIONS:
+        start = time.perf_counter()
+        db.query_project_data(project_name, question)
+        db_queries.append((time.perf_counter() - start) * 1000)
+
+    return stages, db_writes, db_queries
+
+
+def compare(report, baseline, tolerance):
+    """
+    Stages whose median wall time, LLM calls or tokens grew by more than tolerance
+    """
+    regressions = []
+    for name, current in report["stages"].items():
+        previous = baseline.get("stages", {}).get(name)
+        if not previous:
+            continue
+        for metric in ("wall_ms", "llm_calls", "prompt_tokens", "completion_tokens"):
+            old, new = previous.get(metric), current.get(metric)
+            if old and new is not None and new > old * (1 + tolerance):
+                regressions.append(f"{name}.{metric}: {old} -> {new}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the agent pipeline against a stub LLM server")
+    parser.add_argument("--runs", type=int, default=3, help="end-to-end passes; stage metrics are medians")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before the first token of each response")
+    parser.add_argument("--chars-per-second", type=float, default=0, help="simulated generation speed (0 = instant)")
+    parser.add_argument("--response-chars", type=int, default=2000, help="approximate size of free-text responses")
+    parser.add_argument("--stories", type=int, default=5, help="user stories (and test cases) per project")
+    parser.add_argument("--files", type=int, default=4, help="code files per project")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="earlier JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative growth against the baseline")
+    args = parser.parse_args(argv)
+
+    server = StubServer(
+        StubLLM(args.stories, args.files, args.response_chars),
+        latency=args.latency,
+        chars_per_second=args.chars_per_second
+    ).start()
+    data_dir = tempfile.mkdtemp(prefix="genai_bench_")
+
+    # Must be set before the agents and shared clients are created
+    os.environ.update({
+        "LLM_BACKEND": "openai",
+        "LLM_BASE_URL": server.base_url,
+        "LLM_CACHE_ENABLED": "false",
+        "LLM_RATE_LIMIT_PER_MINUTE": "1000000",
+        "LLM_RATE_LIMIT_BURST": "1000",
+        "CHROMA_DB_PATH": data_dir,
+        "TOKENIZER_NAME": "estimate"
+    })
+
+    try:
+        runs = []
+        db_writes = []
+        db_queries = []
+        for i in range(args.runs):
+            stages, writes, queries = run_pipeline(server, f"benchmark-{i+1}")
+            runs.append(stages)
+            db_writes.extend(writes)
+            db_queries.extend(queries)
+            total = sum(stage["wall_ms"] for stage in stages.values())
+            print(f"Run {i+1}/{args.runs}: {total:.0f} ms")
+    finally:
+        server.stop()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "config": vars(args),
+        "stages": {
+            name: {
+                metric: statistics.median(run[name][metric] for run in runs)
+                for metric in runs[0][name]
+            }
+            for name in runs[0]
+        },
+        "chroma": {"write": summarize_ms(db_writes), "query": summarize_ms(db_queries)},
+        "peak_rss_mb": peak_rss_mb(),
+        "runs": runs
+    }
+    report["total_wall_ms"] = round(sum(stage["wall_ms"] for stage in report["stages"].values()), 2)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(json.dumps({key: report[key] for key in ("stages", "chroma", "peak_rss_mb", "total_wall_ms")}, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
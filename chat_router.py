@@ -0,0 +1,127 @@
+import re
+
+# Questions asking for reasons or opinions always go to the LLM, whatever else they mention
+FREE_FORM = re.compile(r"\b(why|how come|explain|should|could|would|improve|fix|suggest|compare|difference)\b")
+
+# Leading politeness and question words stripped before matching
+FILLER = re.compile(
+    r"^(?:(?:please|hey|hi|ok|so|can you|could you|would you|tell me|show me|give me|"
+    r"what|what's|whats|what is|what are|which|is|are|the|our|current|currently|all|me)\s+)*"
+)
+
+
+def _pass_rate(artifacts, match):
+    results = artifacts["test_results"]
+    if not results:
+        return "No tests have been run yet. Run the Testing phase to get results."
+    passed = sum(1 for result in results if result["status"] == "PASS")
+    return f"{passed} of {len(results)} tests passed (pass rate {passed / len(results) * 100:.1f}%)."
+
+
+def _failed_tests(artifacts, match):
+    results = artifacts["test_results"]
+    if not results:
+        return "No tests have been run yet. Run the Testing phase to get results."
+    failed = [result for result in results if result["status"] != "PASS"]
+    if not failed:
+        return f"All {len(results)} tests passed."
+    lines = [f"{len(failed)} of {len(results)} tests did not pass:"]
+    lines.extend(
+        f"- {result['title']} ({result['status']})" + (f": {result['details']}" if result["details"] else "")
+        for result in failed
+    )
+    return "\n".join(lines)
+
+
+def _code_files(artifacts, match):
+    if not artifacts["code"]:
+        return "No code has been generated yet. Run the Development phase first."
+    lines = [f"The project has {len(artifacts['code'])} code files:"]
+    lines.extend(f"- {filename}" for filename in artifacts["code"])
+    return "\n".join(lines)
+
+
+def _user_stories(artifacts, match):
+    stories = artifacts["user_stories"]
+    if not stories:
+        return "No user stories have been written yet. Run the Requirements phase first."
+    lines = [f"There are {len(stories)} user stories:"]
+    lines.extend(f"- User Story #{i + 1}: {story['title']}" for i, story in enumerate(stories))
+    return "\n".join(lines)
+
+
+def _user_story(artifacts, match):
+    stories = artifacts["user_stories"]
+    number = int(match.group("number"))
+    if not 1 <= number <= len(stories):
+        return f"There is no user story #{number}; the project has {len(stories)} user stories."
+    story = stories[number - 1]
+    lines = [
+        f"**User Story #{number}: {story['title']}**",
+        f"As a {story['role']}, I want {story['want']} so that {story['so_that']}.",
+        "",
+        "Acceptance criteria:"
+    ]
+    lines.extend(f"- {criterion}" for criterion in story["acceptance_criteria"])
+    return "\n".join(lines)
+
+
+def _test_case(artifacts, match):
+    tests = artifacts["test_cases"]
+    number = int(match.group("number"))
+    if not 1 <= number <= len(tests):
+        return f"There is no test case #{number}; the project has {len(tests)} test cases."
+    test = tests[number - 1]
+    lines = [f"**Test #{number}: {test['title']}**", test["description"], f"Expected result: {test['expected_result']}"]
+    results = artifacts["test_results"]
+    if number <= len(results):
+        result = results[number - 1]
+        details = f" ({result['details']})" if result["status"] != "PASS" and result["details"] else ""
+        lines.append(f"Status: {result['status']}{details}")
+    return "\n".join(lines)
+
+
+# (intent, pattern over the normalised question, answer function); the first full match wins
+INTENTS = [
+    ("pass_rate", re.compile(
+        r"(?:test |tests )?pass(?:ing)? rate(?: of (?:the |all )?tests)?|test results?(?: summary)?|"
+        r"how many tests (?:have |did )?pass(?:ed)?"
+    ), _pass_rate),
+    ("failed_tests", re.compile(
+        r"(?:list (?:of )?)?(?:failed|failing) tests?|tests? (?:that )?(?:have |did )?fail(?:ed)?|"
+        r"how many tests (?:have |did )?fail(?:ed)?"
+    ), _failed_tests),
+    ("code_files", re.compile(
+        r"(?:list (?:of )?)?(?:the )?(?:code |source )?files(?: (?:are there|do we have|were generated|in the project))?|"
+        r"how many (?:code |source )?files(?: are there| do we have)?"
+    ), _code_files),
+    ("user_story", re.compile(r"(?:user )?story (?:#|no |number )?(?P<number>\d+)"), _user_story),
+    ("user_stories", re.compile(
+        r"(?:list (?:of )?)?(?:the )?user stories|how many user stories(?: are there| do we have)?"
+    ), _user_stories),
+    ("test_case", re.compile(r"test(?: case)? (?:#|no |number )?(?P<number>\d+)"), _test_case),
+]
+
+
+def normalize(question):
+    text = question.lower().strip()
+    text = re.sub(r"[?!.]+$", "", text).strip()
+    text = re.sub(r"#\s*(\d)", r"#\1", text)
+    text = re.sub(r"\s+", " ", text)
+    return FILLER.sub("", text).strip()
+
+
+def route_question(question, artifacts):
+    """
+    Answer factual questions (pass rate, failed tests, code files, user story N, test case N)
+    directly from the artifacts. Returns (intent, answer), or None for questions that need the LLM.
+    Only whole-question matches count, so anything with more to it goes to the LLM.
+    """
+    if FREE_FORM.search(question.lower()):
+        return None
+    text = normalize(question)
+    for intent, pattern, answer in INTENTS:
+        match = pattern.fullmatch(text)
+        if match:
+            return intent, answer(artifacts, match)
+    return None
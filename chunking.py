@@ -0,0 +1,189 @@
+import os
+import re
+import ast
+from utils.prompt_builder import count_tokens
+
+# Largest chunk indexed for retrieval; longer sections and definitions are split further
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "400"))
+
+# Fenced code block in an LLM response
+CODE_BLOCK = re.compile(r"```(?:python|py)?[ \t]*\n(.*?)```", re.DOTALL)
+
+
+def extract_code(text):
+    """
+    Return the first fenced code block in text, or text itself if it has none
+    """
+    match = CODE_BLOCK.search(text)
+    return (match.group(1) if match else text).strip() + "\n"
+
+
+class Chunk:
+    """
+    A retrievable piece of an artifact.
+    path names what it covers (a heading path or "file.py:Class.method"); start_line and
+    end_line are 1-based and inclusive, start and end are character offsets into the source.
+    """
+
+    def __init__(self, path, text, start_line, end_line, start, end):
+        self.path = path
+        self.text = text
+        self.start_line = start_line
+        self.end_line = end_line
+        self.start = start
+        self.end = end
+
+
+def _line_offsets(text):
+    offsets = [0]
+    for line in text.splitlines(keepends=True):
+        offsets.append(offsets[-1] + len(line))
+    return offsets
+
+
+def _lines_chunk(path, lines, offsets, first, last):
+    # Chunk covering lines first..last (0-based, inclusive)
+    return Chunk(path, "".join(lines[first:last + 1]).strip("\n"), first + 1, last + 1, offsets[first], offsets[last + 1])
+
+
+def _split_lines(path, lines, offsets, first, last, max_tokens, boundary=None):
+    """
+    Split lines first..last into chunks under max_tokens, preferring to break after lines
+    for which boundary(line) is true (blank lines by default)
+    """
+    boundary = boundary or (lambda line: not line.strip())
+    # Per-line counts, summed as an estimate of each candidate chunk's size
+    tokens = {i: count_tokens(lines[i]) for i in range(first, last + 1)}
+    chunks = []
+    start = first
+    while start <= last:
+        end = start
+        best = None
+        size = 0
+        while end <= last:
+            size += tokens[end]
+            if size > max_tokens and end > start:
+                break
+            if boundary(lines[end]):
+                best = end
+            end += 1
+        if end > last:
+            best = last
+        elif best is None or best < start:
+            best = max(start, end - 1)
+        part = _lines_chunk(path, lines, offsets, start, best)
+        if part.text.strip():
+            chunks.append(part)
+        start = best + 1
+    return chunks
+
+
+def markdown_sections(text):
+    """
+    Split a Markdown document at its headings, ignoring "#" lines inside fenced code blocks.
+    Returns (path, title, heading_line, last_line) per section, with 0-based line numbers;
+    path is the heading trail ("Architecture > API"). Text before the first heading is a section
+    titled "Overview" whose heading_line is None.
+    """
+    lines = text.splitlines()
+    sections = []
+    trail = []
+    start = 0
+    heading_line = None
+    title = path = "Overview"
+    in_fence = False
+    for i, line in enumerate(lines + ["# "]):
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+        match = None if in_fence else re.match(r"^(#{1,6})\s+(.*)$", line)
+        if not match:
+            continue
+        if i > start:
+            sections.append((path, title, heading_line, i - 1))
+        level = len(match.group(1))
+        title = match.group(2).strip()
+        trail = [entry for entry in trail if entry[0] < level] + [(level, title)]
+        path = " > ".join(heading for _, heading in trail)
+        start = heading_line = i
+    return sections
+
+
+def chunk_markdown(text, max_tokens=None):
+    """
+    Split a Markdown document at its headings. Each chunk's path is its heading trail
+    ("Architecture > API"); sections over max_tokens are split at blank lines.
+    """
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    lines = text.splitlines(keepends=True)
+    offsets = _line_offsets(text)
+    chunks = []
+    for path, _, heading_line, last in markdown_sections(text):
+        first = 0 if heading_line is None else heading_line
+        chunks.extend(_split_lines(path, lines, offsets, first, last, max_tokens))
+    return chunks
+
+
+def chunk_python(code, filename, max_tokens=None):
+    """
+    Split Python source into one chunk per top-level function or class, plus the module-level
+    code between them. Classes over max_tokens are split into their methods.
+    Falls back to line windows when the source does not parse.
+    """
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    lines = code.splitlines(keepends=True)
+    offsets = _line_offsets(code)
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return _split_lines(filename, lines, offsets, 0, len(lines) - 1, max_tokens)
+
+    def first_line(node):
+        # Include decorators
+        return min([node.lineno] + [decorator.lineno for decorator in getattr(node, "decorator_list", [])]) - 1
+
+    definitions = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+    chunks = []
+    module_lines = []
+    covered = 0
+    for node in tree.body:
+        if not isinstance(node, definitions):
+            continue
+        start, end = first_line(node), node.end_lineno - 1
+        module_lines.extend(range(covered, start))
+        covered = end + 1
+        path = f"{filename}:{node.name}"
+        if count_tokens("".join(lines[start:end + 1])) <= max_tokens:
+            chunks.append(_lines_chunk(path, lines, offsets, start, end))
+            continue
+        if isinstance(node, ast.ClassDef):
+            methods = [child for child in node.body if isinstance(child, definitions)]
+            # The class header and attributes up to the first method
+            header_end = (first_line(methods[0]) - 1) if methods else end
+            chunks.extend(_split_lines(path, lines, offsets, start, header_end, max_tokens))
+            for method in methods:
+                method_path = f"{path}.{method.name}"
+                chunks.extend(_split_lines(
+                    method_path, lines, offsets, first_line(method), method.end_lineno - 1, max_tokens
+                ))
+        else:
+            chunks.extend(_split_lines(path, lines, offsets, start, end, max_tokens))
+    module_lines.extend(range(covered, len(lines)))
+
+    # Module-level code (imports, constants, main block) grouped into contiguous runs
+    runs = []
+    for line_number in module_lines:
+        if runs and runs[-1][1] == line_number - 1:
+            runs[-1][1] = line_number
+        else:
+            runs.append([line_number, line_number])
+    for first, last in runs:
+        chunks.extend(_split_lines(f"{filename}:<module>", lines, offsets, first, last, max_tokens))
+
+    return sorted(chunks, key=lambda chunk: chunk.start)
+
+
+def chunk_code_file(filename, code, max_tokens=None):
+    if filename.endswith(".py"):
+        return chunk_python(code, filename, max_tokens)
+    lines = code.splitlines(keepends=True)
+    return _split_lines(filename, lines, _line_offsets(code), 0, len(lines) - 1, max_tokens or CHUNK_MAX_TOKENS)
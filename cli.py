@@ -0,0 +1,175 @@
+"""
+Headless batch runner for the agent pipeline, without Streamlit.
+
+    python cli.py requirements/ --output out/ --parallelism 4
+    python cli.py projects.jsonl --output out/ --until code
+
+The input is a directory of .txt/.md requirement documents (the file name is the project name)
+or a JSONL file of {"project_name": ..., "requirements": ...} records. Every finished stage is
+checkpointed in ChromaDB, so an interrupted batch resumes where it stopped, and each project's
+artifacts are written to its own folder under --output.
+
+The same runner is available as a Python API: load_records(), run_project() and run_batch().
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.pipeline import build_default_pipeline
+from utils.registry import get_db_manager
+from utils.chunking import extract_code
+from utils.tracing import propagate, set_project
+
+STAGES = ["user_stories", "design_doc", "code", "test_cases", "test_results"]
+
+
+def load_records(path):
+    """
+    Read {"project_name", "requirements"} records from a JSONL file or a directory of documents
+    """
+    if os.path.isdir(path):
+        records = []
+        for filename in sorted(os.listdir(path)):
+            name, extension = os.path.splitext(filename)
+            if extension.lower() in (".txt", ".md"):
+                with open(os.path.join(path, filename), encoding="utf-8") as f:
+                    records.append({"project_name": name, "requirements": f.read()})
+        return records
+
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not record.get("project_name") or not record.get("requirements"):
+                raise ValueError(f"{path}:{line_number}: project_name and requirements are required")
+            records.append(record)
+    return records
+
+
+def safe_name(name):
+    return re.sub(r"[^\w.-]+", "_", name).strip("._") or "project"
+
+
+def write_outputs(project_dir, requirements, artifacts):
+    """
+    Write each artifact to the project's output folder; code files go under code/
+    """
+    os.makedirs(project_dir, exist_ok=True)
+
+    def write(relative_path, text):
+        path = os.path.normpath(os.path.join(project_dir, relative_path))
+        if not path.startswith(os.path.abspath(project_dir) + os.sep):
+            print(f"Skipping output outside the project folder: {relative_path}")
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    write("requirements.md", requirements)
+    if artifacts.get("user_stories"):
+        write("user_stories.json", json.dumps(artifacts["user_stories"], indent=2))
+    if artifacts.get("design_doc"):
+        write("design_doc.md", artifacts["design_doc"])
+    for filename, code in (artifacts.get("code") or {}).items():
+        write(os.path.join("code", filename), extract_code(code) if filename.endswith(".py") else code)
+    if artifacts.get("test_cases"):
+        write("test_cases.json", json.dumps(artifacts["test_cases"], indent=2))
+    if artifacts.get("test_results"):
+        write("test_results.json", json.dumps(artifacts["test_results"], indent=2))
+
+
+def run_project(project_name, requirements, output_dir, until="test_results", resume=True):
+    """
+    Run the pipeline for one project up to the stage until and return a summary dict.
+    With resume, artifacts from the project's last checkpoint are reused when their inputs are unchanged.
+    """
+    project_dir = os.path.join(os.path.abspath(output_dir), safe_name(project_name))
+    db = get_db_manager()
+    set_project(project_name)
+
+    checkpoint = db.load_checkpoint(project_name) if resume else None
+    artifacts = checkpoint["artifacts"] if checkpoint else {}
+    manifest = checkpoint["manifest"] if checkpoint else {}
+    # Stored on every run so edited requirements replace the checkpointed ones; unchanged text is a no-op
+    db.store_requirements(project_name, requirements)
+
+    def on_record(name, value):
+        db.store_artifact(project_name, name, value)
+        db.save_checkpoint(project_name, {"artifacts": artifacts, "manifest": manifest})
+        print(f"[{project_name}] {name} done")
+
+    pipeline = build_default_pipeline(artifacts, manifest, {"requirements": requirements}, on_record=on_record)
+    pending = pipeline.stale_stages(until)
+    start = time.perf_counter()
+    try:
+        pipeline.run(until)
+    finally:
+        write_outputs(project_dir, requirements, artifacts)
+
+    summary = {
+        "project_name": project_name,
+        "output": project_dir,
+        "stages_run": pending,
+        "elapsed_s": round(time.perf_counter() - start, 2)
+    }
+    if artifacts.get("test_results"):
+        results = artifacts["test_results"]
+        summary["tests_passed"] = sum(1 for result in results if result["status"] == "PASS")
+        summary["tests_total"] = len(results)
+    with open(os.path.join(project_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def run_batch(records, output_dir, parallelism=2, until="test_results", resume=True):
+    """
+    Run many projects concurrently. Returns one summary per record, with "error" set for failed projects.
+    """
+    summaries = []
+    with ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+        futures = {
+            executor.submit(
+                propagate(run_project), record["project_name"], record["requirements"], output_dir, until, resume
+            ): record["project_name"]
+            for record in records
+        }
+        for future in as_completed(futures):
+            project_name = futures[future]
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                print(f"[{project_name}] failed: {str(e)}")
+                summaries.append({"project_name": project_name, "error": str(e)})
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the agent pipeline over a batch of requirement documents")
+    parser.add_argument("input", help="directory of .txt/.md requirement files, or a JSONL file of records")
+    parser.add_argument("--output", default="output", help="folder for the per-project outputs")
+    parser.add_argument("--parallelism", type=int, default=int(os.getenv("BATCH_PARALLELISM", "2")),
+                        help="projects processed concurrently")
+    parser.add_argument("--until", choices=STAGES, default="test_results", help="last stage to run")
+    parser.add_argument("--no-resume", action="store_true", help="ignore existing checkpoints and start over")
+    args = parser.parse_args(argv)
+
+    records = load_records(args.input)
+    print(f"Processing {len(records)} projects with parallelism {args.parallelism}")
+    summaries = run_batch(records, args.output, args.parallelism, args.until, not args.no_resume)
+
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, "batch_summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summaries, f, indent=2)
+
+    failed = [summary for summary in summaries if "error" in summary]
+    print(f"{len(summaries) - len(failed)} projects completed, {len(failed)} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,58 +1,185 @@
 import os
-import requests
 from dotenv import load_dotenv
+from utils.llm_cache import ResponseCache, get_response_cache
+from utils.prompt_builder import count_tokens
+from utils.tracing import get_tracer
+from utils.llm_backends import get_backend, translate_error
+from utils.llm_resilience import RetryPolicy, get_coalescer, get_rate_limiter
 
 # Load environment variables
 load_dotenv()
 
+
 class LLMHandler:
-    def __init__(self):
-        self.api_key = os.getenv("HUGGINGFACE_API_KEY")
-        self.model_name = os.getenv("MODEL_NAME", "mistralai/Mixtral-8x7B-Instruct-v0.1")
+    def __init__(self, backend=None):
+        # Inference engine selected by LLM_BACKEND (hosted Hugging Face API by default)
+        self.backend = backend or get_backend()
+        self.model_name = self.backend.model_name
         self.max_tokens = int(os.getenv("MAX_TOKENS", "2048"))
         self.temperature = float(os.getenv("TEMPERATURE", "0.7"))
-        
-        if not self.api_key:
-            raise ValueError("HUGGINGFACE_API_KEY not found in environment variables")
-    
-    def get_response(self, prompt, system_prompt=None):
-       # Get a response from the language model
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
+        self.top_p = 0.95
+        self.cache = get_response_cache()
+        self.retry_policy = RetryPolicy()
+
+    def get_response(self, prompt, system_prompt=None, use_cache=True):
+        """
+        Get a response from the language model.
+        Calls are rate limited process-wide, retried with backoff on 429/503/timeouts, and
+        concurrent identical requests share one upstream call. Raises LLMError on failure.
+        """
+        formatted_prompt = self.format_prompt(prompt, system_prompt)
+        with get_tracer().span("llm.generate", **self._span_attributes(formatted_prompt)) as span:
+            cache_key = self._cache_key(prompt, system_prompt) if use_cache else None
+            if cache_key:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    self._finish_span(span, cached, cache_hit=True)
+                    return cached
+
+            text = get_coalescer().run(
+                self._request_key(formatted_prompt),
+                lambda: self.retry_policy.call(lambda: self._generate(formatted_prompt), get_rate_limiter())
+            )
+            if cache_key:
+                self.cache.set(cache_key, self.model_name, text)
+            self._finish_span(span, text)
+            return text
+
+    async def aget_response(self, prompt, system_prompt=None, use_cache=True):
+        # Async variant of get_response
+        formatted_prompt = self.format_prompt(prompt, system_prompt)
+        with get_tracer().span("llm.agenerate", **self._span_attributes(formatted_prompt)) as span:
+            cache_key = self._cache_key(prompt, system_prompt) if use_cache else None
+            if cache_key:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    self._finish_span(span, cached, cache_hit=True)
+                    return cached
+
+            async def generate():
+                try:
+                    return await self.backend.agenerate(formatted_prompt, self._params())
+                except Exception as e:
+                    raise translate_error(e) from e
+
+            text = await get_coalescer().arun(
+                self._request_key(formatted_prompt),
+                lambda: self.retry_policy.acall(generate, get_rate_limiter())
+            )
+            if cache_key:
+                self.cache.set(cache_key, self.model_name, text)
+            self._finish_span(span, text)
+            return text
+
+    def stream_response(self, prompt, system_prompt=None, use_cache=True):
+        """
+        Yield the completion as text chunks using the backend's streaming mode.
+        Failures before the first chunk are retried; later failures raise LLMError.
+        The full text is cached once the stream finishes, and a cache hit is yielded as a single chunk.
+        """
+        formatted_prompt = self.format_prompt(prompt, system_prompt)
+        # Not activated: the span stays open across yields to the consumer
+        span = get_tracer().start("llm.stream", activate=False, **self._span_attributes(formatted_prompt))
+        try:
+            cache_key = self._cache_key(prompt, system_prompt) if use_cache else None
+            if cache_key:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    self._finish_span(span, cached, cache_hit=True)
+                    span.finish()
+                    yield cached
+                    return
+
+            def open_stream():
+                try:
+                    stream = self.backend.stream(formatted_prompt, self._params())
+                    return next(stream, None), stream
+                except Exception as e:
+                    raise translate_error(e) from e
+
+            first_chunk, stream = self.retry_policy.call(open_stream, get_rate_limiter())
+            span.set("first_chunk_ms", round(span.elapsed_ms(), 1))
+            if first_chunk is None:
+                self._finish_span(span, "")
+                span.finish()
+                return
+
+            chunks = [first_chunk]
+            yield first_chunk
+            try:
+                for chunk in stream:
+                    chunks.append(chunk)
+                    yield chunk
+            except Exception as e:
+                raise translate_error(e) from e
+
+            text = "".join(chunks).strip()
+            if cache_key:
+                self.cache.set(cache_key, self.model_name, text)
+            self._finish_span(span, text)
+            span.finish()
+        except GeneratorExit:
+            # The consumer stopped reading early
+            span.set("cancelled", True)
+            span.finish()
+            raise
+        except BaseException as e:
+            span.finish(error=e)
+            raise
+
+    def invalidate(self, prompt, system_prompt=None):
+        """
+        Drop the cached completion of a prompt, e.g. one that could not be parsed,
+        so the next call asks the model again instead of replaying the same text
+        """
+        cache_key = self._cache_key(prompt, system_prompt)
+        if cache_key:
+            self.cache.delete(cache_key)
+
+    def format_prompt(self, prompt, system_prompt=None):
         # Format the prompt based on whether a system prompt is provided
         if system_prompt:
-            formatted_prompt = f"<s>[INST] {system_prompt} [/INST]</s>\n<s>[INST] {prompt} [/INST]"
-        else:
-            formatted_prompt = f"<s>[INST] {prompt} [/INST]"
-        
-        payload = {
-            "inputs": formatted_prompt,
-            "parameters": {
-                "max_new_tokens": self.max_tokens,
-                "temperature": self.temperature,
-                "top_p": 0.95,
-                "do_sample": True
-            }
+            return f"<s>[INST] {system_prompt} [/INST]</s>\n<s>[INST] {prompt} [/INST]"
+        return f"<s>[INST] {prompt} [/INST]"
+
+    def _span_attributes(self, formatted_prompt):
+        return {
+            "backend": self.backend.name,
+            "model": self.model_name,
+            "prompt_tokens": count_tokens(formatted_prompt),
+            "prompt_bytes": len(formatted_prompt.encode("utf-8")),
+            "cache_hit": False
         }
-        
-        api_url = f"https://api-inference.huggingface.co/models/{self.model_name}"
-        
+
+    def _finish_span(self, span, text, cache_hit=False):
+        # Record the completion size on an LLM span
+        span.set("cache_hit", cache_hit)
+        span.set("completion_tokens", count_tokens(text))
+        span.set("completion_bytes", len(text.encode("utf-8")))
+
+    def _generate(self, formatted_prompt):
         try:
-            response = requests.post(api_url, headers=headers, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            
-            # Extract the generated text
-            if isinstance(result, list) and len(result) > 0 and "generated_text" in result[0]:
-                return result[0]["generated_text"].strip()
-            elif isinstance(result, dict) and "generated_text" in result:
-                return result["generated_text"].strip()
-            else:
-                return str(result)
-                
+            return self.backend.generate(formatted_prompt, self._params())
         except Exception as e:
-            print(f"Error calling Hugging Face API: {str(e)}")
-            return f"Error: {str(e)}"
\ No newline at end of file
+            raise translate_error(e) from e
+
+    def _request_key(self, formatted_prompt):
+        return ResponseCache.make_key(
+            f"{self.backend.name}/{self.model_name}",
+            formatted_prompt,
+            self.temperature,
+            self.max_tokens,
+            self.top_p
+        )
+
+    def _params(self):
+        return {
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "top_p": self.top_p
+        }
+
+    def _cache_key(self, prompt, system_prompt=None):
+        if self.cache is None:
+            return None
+        return self._request_key(self.format_prompt(prompt, system_prompt))
@@ -1,14 +1,39 @@
 import os
 import json
+import time
+import hashlib
+import threading
 import chromadb
 from chromadb.config import Settings
+from chromadb.utils import embedding_functions
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from utils.tracing import get_tracer
+from utils.chunking import chunk_markdown, chunk_code_file, extract_code
+from utils.pipeline import content_hash
+
+# Maximum number of records sent to a collection in one upsert call
+BULK_BATCH_SIZE = int(os.getenv("CHROMA_BULK_BATCH_SIZE", "256"))
+# Versions kept per artifact of a project; records only older versions refer to are deleted
+ARTIFACT_VERSIONS_KEPT = max(1, int(os.getenv("ARTIFACT_VERSIONS_KEPT", "3")))
+
+# Collection key each versioned artifact is stored in
+ARTIFACT_COLLECTIONS = {
+    "requirements": "requirements",
+    "user_stories": "user_stories",
+    "design_doc": "design",
+    "code": "code",
+    "test_cases": "tests",
+    "test_results": "tests"
+}
 
 class ChromaManager:
     def __init__(self):
         self.client = chromadb.PersistentClient(
             path=os.getenv("CHROMA_DB_PATH", "./data")
         )
+        # One embedding function shared by every collection so queries can be embedded once
+        self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
         
         # Create collections if they don't exist
         self.requirements_collection = self._get_or_create_collection("requirements")
@@ -17,101 +42,452 @@ class ChromaManager:
         self.code_collection = self._get_or_create_collection("code")
         self.test_collection = self._get_or_create_collection("tests")
         self.chat_collection = self._get_or_create_collection("conversations")
+        self.checkpoint_collection = self._get_or_create_collection("checkpoints")
+        self.chunk_collection = self._get_or_create_collection("artifact_chunks")
+        self.manifest_collection = self._get_or_create_collection("artifact_manifests")
+        # Standalone chat questions (embedded alone) with their answers, for the semantic answer cache
+        self.answer_cache_collection = self._get_or_create_collection("answer_cache")
+        # One lock per project serialises read-modify-write updates of its manifest
+        self._manifest_locks = {}
+        self._manifest_locks_guard = threading.Lock()
     
     def _get_or_create_collection(self, name):
         try:
-            return self.client.get_collection(name=name)
+            return self.client.get_collection(name=name, embedding_function=self.embedding_function)
         except:
-            return self.client.create_collection(name=name)
+            return self.client.create_collection(name=name, embedding_function=self.embedding_function)
     
     def store_requirements(self, project_name, requirements):
-        timestamp = datetime.now().isoformat()
-        self.requirements_collection.add(
-            documents=[requirements],
-            metadatas=[{"project": project_name, "timestamp": timestamp}],
-            ids=[f"{project_name}_requirements_{timestamp}"]
-        )
+        return self._store_version(project_name, "requirements", requirements, [
+            {"document": requirements, "metadata": {}}
+        ])
     
     def store_user_stories(self, project_name, user_stories):
-        timestamp = datetime.now().isoformat()
-        for i, story in enumerate(user_stories):
-            self.user_stories_collection.add(
-                documents=[json.dumps(story)],
-                metadatas=[{
-                    "project": project_name, 
-                    "timestamp": timestamp,
-                    "story_id": i,
-                    "title": story["title"]
-                }],
-                ids=[f"{project_name}_story_{i}_{timestamp}"]
-            )
+        return self._store_version(project_name, "user_stories", user_stories, [
+            {"document": json.dumps(story), "metadata": {"title": story["title"]}}
+            for story in user_stories
+        ])
     
     def store_design_doc(self, project_name, design_doc):
-        timestamp = datetime.now().isoformat()
-        self.design_collection.add(
-            documents=[design_doc],
-            metadatas=[{"project": project_name, "timestamp": timestamp}],
-            ids=[f"{project_name}_design_{timestamp}"]
-        )
+        version = self._store_version(project_name, "design_doc", design_doc, [
+            {"document": design_doc, "metadata": {}}
+        ])
+        self.index_chunks(project_name, "design", chunk_markdown(design_doc))
+        return version
     
     def store_code(self, project_name, code_files):
-        timestamp = datetime.now().isoformat()
+        version = self._store_version(project_name, "code", code_files, [
+            {"document": code, "metadata": {"filename": filename}}
+            for filename, code in code_files.items()
+        ])
+        chunks = []
         for filename, code in code_files.items():
-            self.code_collection.add(
-                documents=[code],
-                metadatas=[{
-                    "project": project_name, 
-                    "timestamp": timestamp,
-                    "filename": filename
-                }],
-                ids=[f"{project_name}_code_{filename}_{timestamp}"]
-            )
+            chunks.extend(chunk_code_file(filename, extract_code(code) if filename.endswith(".py") else code))
+        self.index_chunks(project_name, "code", chunks)
+        return version
     
     def store_test_cases(self, project_name, test_cases):
-        timestamp = datetime.now().isoformat()
-        for i, test in enumerate(test_cases):
-            self.test_collection.add(
-                documents=[json.dumps(test)],
-                metadatas=[{
-                    "project": project_name, 
-                    "timestamp": timestamp,
-                    "test_id": i,
-                    "title": test["title"],
-                    "type": "test_case"
-                }],
-                ids=[f"{project_name}_test_case_{i}_{timestamp}"]
-            )
+        return self._store_version(project_name, "test_cases", test_cases, [
+            {"document": json.dumps(test), "metadata": {"title": test["title"], "type": "test_case"}}
+            for test in test_cases
+        ])
     
     def store_test_results(self, project_name, test_results):
-        timestamp = datetime.now().isoformat()
-        for i, result in enumerate(test_results):
-            self.test_collection.add(
-                documents=[json.dumps(result)],
-                metadatas=[{
-                    "project": project_name, 
-                    "timestamp": timestamp,
-                    "test_id": i,
-                    "title": result["title"],
-                    "type": "test_result",
-                    "status": result["status"]
-                }],
-                ids=[f"{project_name}_test_result_{i}_{timestamp}"]
+        return self._store_version(project_name, "test_results", test_results, [
+            {
+                "document": json.dumps(result),
+                "metadata": {"title": result["title"], "type": "test_result", "status": result["status"]}
+            }
+            for result in test_results
+        ])
+    
+    def _store_version(self, project_name, artifact, value, items):
+        """
+        Record a new version of one artifact and return its version number.
+        Every record (a story, a code file, ...) is keyed by the hash of its own content, so only
+        records that did not exist yet are embedded, and storing an unchanged artifact creates no
+        version. The project manifest lists, per artifact, its last ARTIFACT_VERSIONS_KEPT versions
+        as ordered record ids; records no kept version refers to are deleted. Records of the latest
+        version carry latest=True, which query_project_data filters on.
+        """
+        digest = content_hash(value)[:24]
+        collection = self._collections()[ARTIFACT_COLLECTIONS[artifact]]
+        ids = [
+            f"{project_name}_{artifact}_{content_hash([item['document'], item['metadata']])[:24]}"
+            for item in items
+        ]
+        records = dict(zip(ids, items))
+        
+        latest = self.latest_version(project_name, artifact)
+        if latest and latest["digest"] == digest:
+            return latest["version"]
+        
+        # The embedding pass runs outside the manifest lock, so projects are stored concurrently
+        self._add_records(project_name, artifact, collection, records)
+        
+        with self._project_lock(project_name):
+            manifest = self.load_manifest(project_name)
+            if not manifest["artifacts"]:
+                self._drop_unversioned(project_name)
+            versions = manifest["artifacts"].setdefault(artifact, [])
+            previous = versions[-1] if versions else None
+            if previous and previous["digest"] == digest:
+                return previous["version"]
+            
+            # Records garbage-collected by a concurrent write since the pass above are added again
+            self._add_records(project_name, artifact, collection, records)
+            
+            version = (previous["version"] if previous else 0) + 1
+            versions.append({
+                "version": version,
+                "digest": digest,
+                "items": ids,
+                "timestamp": datetime.now().isoformat()
+            })
+            dropped = versions[:-ARTIFACT_VERSIONS_KEPT]
+            del versions[:-ARTIFACT_VERSIONS_KEPT]
+            
+            kept = {record_id for entry in versions for record_id in entry["items"]}
+            superseded = {record_id for entry in dropped for record_id in entry["items"]} - kept
+            if superseded:
+                collection.delete(ids=list(superseded))
+            self._mark_latest(
+                collection,
+                set(ids),
+                set(previous["items"]) - set(ids) - superseded if previous else set()
             )
+            self._save_manifest(project_name, manifest)
+            return version
+    
+    def _add_records(self, project_name, artifact, collection, records):
+        existing = set(collection.get(ids=list(records), include=[])["ids"]) if records else set()
+        timestamp = datetime.now().isoformat()
+        self.bulk_store(ARTIFACT_COLLECTIONS[artifact], [
+            {
+                "id": record_id,
+                "document": item["document"],
+                "metadata": dict(
+                    item["metadata"],
+                    project=project_name,
+                    artifact=artifact,
+                    latest=False,
+                    timestamp=timestamp
+                )
+            }
+            for record_id, item in records.items() if record_id not in existing
+        ])
+    
+    def _mark_latest(self, collection, current, previous):
+        # Metadata-only update: flips the latest flag without re-embedding the records
+        changed = list(current | previous)
+        if not changed:
+            return
+        result = collection.get(ids=changed, include=["metadatas"])
+        collection.update(
+            ids=result["ids"],
+            metadatas=[
+                dict(metadata, latest=record_id in current)
+                for record_id, metadata in zip(result["ids"], result["metadatas"])
+            ]
+        )
+    
+    def _project_lock(self, project_name):
+        # Manifest updates are serialised per project only
+        with self._manifest_locks_guard:
+            return self._manifest_locks.setdefault(project_name, threading.Lock())
+    
+    def _drop_unversioned(self, project_name):
+        # Records written before artifacts were versioned (timestamp ids) are replaced by the first version
+        for kind in set(ARTIFACT_COLLECTIONS.values()):
+            collection = self._collections()[kind]
+            existing = collection.get(where={"project": project_name}, include=["metadatas"])
+            legacy = [
+                record_id for record_id, metadata in zip(existing["ids"], existing["metadatas"])
+                if "artifact" not in metadata
+            ]
+            if legacy:
+                collection.delete(ids=legacy)
+    
+    def load_manifest(self, project_name):
+        """
+        The project's version manifest:
+        {"artifacts": {name: [{"version", "digest", "items": [record ids], "timestamp"}, ...]}}, oldest first
+        """
+        result = self.manifest_collection.get(ids=[f"{project_name}_manifest"])
+        if not result["documents"]:
+            return {"artifacts": {}}
+        return json.loads(result["documents"][0])
+    
+    def _save_manifest(self, project_name, manifest):
+        # Looked up by id only, like checkpoints, so a constant embedding skips the embedding pass
+        self.manifest_collection.upsert(
+            documents=[json.dumps(manifest)],
+            embeddings=[[1.0]],
+            metadatas=[{"project": project_name, "timestamp": datetime.now().isoformat()}],
+            ids=[f"{project_name}_manifest"]
+        )
+    
+    def latest_version(self, project_name, artifact):
+        """
+        The artifact's most recent version entry, or None if it has not been stored
+        """
+        versions = self.load_manifest(project_name)["artifacts"].get(artifact)
+        return versions[-1] if versions else None
+    
+    def load_artifact(self, project_name, artifact, version=None):
+        """
+        Read an artifact back as stored in the given version (the latest by default), or None
+        """
+        versions = self.load_manifest(project_name)["artifacts"].get(artifact, [])
+        matching = [entry for entry in versions if version is None or entry["version"] == version]
+        if not matching:
+            return None
+        ids = matching[-1]["items"]
+        result = self._collections()[ARTIFACT_COLLECTIONS[artifact]].get(
+            ids=list(dict.fromkeys(ids)), include=["documents", "metadatas"]
+        )
+        records = {
+            record_id: (metadata, document)
+            for record_id, metadata, document in zip(result["ids"], result["metadatas"], result["documents"])
+        }
+        ordered = [records[record_id] for record_id in ids if record_id in records]
+        if artifact in ("requirements", "design_doc"):
+            return ordered[0][1] if ordered else ""
+        if artifact == "code":
+            return {metadata["filename"]: document for metadata, document in ordered}
+        return [json.loads(document) for _, document in ordered]
+    
+    def store_artifact(self, project_name, name, value):
+        """
+        Store a pipeline artifact by its artifact name and return the project's version number
+        """
+        store = {
+            "requirements": self.store_requirements,
+            "user_stories": self.store_user_stories,
+            "design_doc": self.store_design_doc,
+            "code": self.store_code,
+            "test_cases": self.store_test_cases,
+            "test_results": self.store_test_results
+        }[name]
+        return store(project_name, value)
+    
+    def index_chunks(self, project_name, source, chunks):
+        """
+        Replace the retrieval chunks of one source ("design" or "code") of a project.
+        Chunk ids are content hashes, so only new or changed chunks are embedded and
+        chunks that no longer exist are deleted.
+        """
+        items = {}
+        for chunk in chunks:
+            digest = hashlib.sha256(f"{source}\0{chunk.path}\0{chunk.text}".encode("utf-8")).hexdigest()[:24]
+            items[f"{project_name}_chunk_{digest}"] = {
+                "id": f"{project_name}_chunk_{digest}",
+                "document": chunk.text,
+                "metadata": {
+                    "project": project_name,
+                    "source": source,
+                    "path": chunk.path,
+                    "start_line": chunk.start_line,
+                    "end_line": chunk.end_line,
+                    "start": chunk.start,
+                    "end": chunk.end
+                }
+            }
+        
+        existing = set(self.chunk_collection.get(
+            where={"$and": [{"project": project_name}, {"source": source}]},
+            include=[]
+        )["ids"])
+        stale = [chunk_id for chunk_id in existing if chunk_id not in items]
+        if stale:
+            self.chunk_collection.delete(ids=stale)
+        self.bulk_store("chunks", [item for chunk_id, item in items.items() if chunk_id not in existing])
+    
+    def query_chunks(self, project_name, query, limit=8):
+        """
+        The project's chunks most similar to query, best first, as dicts with
+        "text", "distance" and the chunk metadata (source, path, lines and offsets)
+        """
+        with get_tracer().span("db.query_chunks", limit=limit) as span:
+            try:
+                result = self.chunk_collection.query(
+                    query_embeddings=self.embedding_function([query]),
+                    n_results=limit,
+                    where={"project": project_name}
+                )
+            except Exception as e:
+                print(f"Error querying chunks: {str(e)}")
+                return []
+            chunks = [
+                dict(metadata, text=document, distance=distance)
+                for document, metadata, distance in zip(
+                    result["documents"][0], result["metadatas"][0], result["distances"][0]
+                )
+            ]
+            span.set("items", len(chunks))
+        return chunks
+    
+    def bulk_store(self, kind, items):
+        """
+        Upsert many records into one collection with a single embedding pass per chunk.
+        kind is a collection key ("requirements", "user_stories", "design", "code", "tests", "conversations", "chunks")
+        and each item is a dict with "id", "document" and "metadata".
+        """
+        collection = self._collections()[kind]
+        
+        with get_tracer().span(
+            "db.store",
+            collection=kind,
+            items=len(items),
+            bytes=sum(len(item["document"].encode("utf-8")) for item in items)
+        ):
+            for start in range(0, len(items), BULK_BATCH_SIZE):
+                chunk = items[start:start + BULK_BATCH_SIZE]
+                collection.upsert(
+                    documents=[item["document"] for item in chunk],
+                    metadatas=[item["metadata"] for item in chunk],
+                    ids=[item["id"] for item in chunk]
+                )
+    
+    def _collections(self):
+        return {
+            "requirements": self.requirements_collection,
+            "user_stories": self.user_stories_collection,
+            "design": self.design_collection,
+            "code": self.code_collection,
+            "tests": self.test_collection,
+            "conversations": self.chat_collection,
+            "chunks": self.chunk_collection
+        }
     
     def store_conversation(self, project_name, question, answer):
         timestamp = datetime.now().isoformat()
-        self.chat_collection.add(
-            documents=[question + "\n\n" + answer],
-            metadatas=[{
+        self.bulk_store("conversations", [{
+            "id": f"{project_name}_chat_{timestamp}",
+            "document": question + "\n\n" + answer,
+            "metadata": {
                 "project": project_name, 
                 "timestamp": timestamp,
-                "question": question[:100]  # Store a preview
+                "question": question[:100],  # Store a preview
+                "answer_offset": len(question) + 2
+            }
+        }])
+    
+    def store_cached_answer(self, project_name, question, answer, artifact_version):
+        """
+        Keep an answer to a standalone question for find_cached_answer.
+        artifact_version stamps the artifacts the answer was based on; entries for any other
+        version of the project can never match again and are deleted.
+        """
+        self.answer_cache_collection.delete(
+            where={"$and": [{"project": project_name}, {"artifact_version": {"$ne": artifact_version}}]}
+        )
+        digest = hashlib.sha256(f"{artifact_version}\0{question}".encode("utf-8")).hexdigest()[:24]
+        self.answer_cache_collection.upsert(
+            documents=[question],
+            metadatas=[{
+                "project": project_name,
+                "artifact_version": artifact_version,
+                "answer": answer,
+                "timestamp": datetime.now().isoformat()
             }],
-            ids=[f"{project_name}_chat_{timestamp}"]
+            ids=[f"{project_name}_answer_{digest}"]
+        )
+    
+    def find_cached_answer(self, project_name, question, artifact_version, min_similarity):
+        """
+        The cached answer to the question most similar to this one, given for the same project and
+        artifact version, if its cosine similarity is at least min_similarity; otherwise None.
+        Returns {"question", "answer", "similarity"}.
+        """
+        with get_tracer().span("db.find_cached_answer") as span:
+            try:
+                result = self.answer_cache_collection.query(
+                    query_embeddings=self.embedding_function([question]),
+                    n_results=1,
+                    where={"$and": [{"project": project_name}, {"artifact_version": artifact_version}]}
+                )
+            except Exception as e:
+                print(f"Error querying cached answers: {str(e)}")
+                return None
+            if not result["documents"][0]:
+                span.set("cache_hit", False)
+                return None
+            document, metadata = result["documents"][0][0], result["metadatas"][0][0]
+            # Collections use squared L2 distance over normalised embeddings: d = 2 - 2 * cosine
+            similarity = 1 - result["distances"][0][0] / 2
+            span.set("cache_hit", similarity >= min_similarity)
+            span.set("similarity", round(similarity, 4))
+            if similarity < min_similarity:
+                return None
+            return {"question": document, "answer": metadata["answer"], "similarity": similarity}
+    
+    def query_conversations(self, project_name, query, limit=3):
+        """
+        Earlier chat exchanges of the project most similar to query, best first,
+        as dicts with "question", "answer", "timestamp" and "distance"
+        """
+        with get_tracer().span("db.query_conversations", limit=limit) as span:
+            try:
+                result = self.chat_collection.query(
+                    query_embeddings=self.embedding_function([query]),
+                    n_results=limit,
+                    where={"project": project_name}
+                )
+            except Exception as e:
+                print(f"Error querying conversations: {str(e)}")
+                return []
+            exchanges = []
+            for document, metadata, distance in zip(
+                result["documents"][0], result["metadatas"][0], result["distances"][0]
+            ):
+                # Exchanges stored before answer_offset was recorded are split at the first blank line
+                offset = metadata.get("answer_offset")
+                if offset is None:
+                    split = document.find("\n\n")
+                    offset = split + 2 if split >= 0 else 0
+                exchanges.append({
+                    "question": document[:offset].strip(),
+                    "answer": document[offset:].strip(),
+                    "timestamp": metadata.get("timestamp"),
+                    "distance": distance
+                })
+            span.set("items", len(exchanges))
+        return exchanges
+    
+    def save_checkpoint(self, project_name, state):
+        """
+        Overwrite the project's resumable pipeline state (artifacts and manifest).
+        Checkpoints are looked up by id only, so a constant embedding skips the embedding pass.
+        """
+        self.checkpoint_collection.upsert(
+            documents=[json.dumps(state)],
+            embeddings=[[1.0]],
+            metadatas=[{"project": project_name, "timestamp": datetime.now().isoformat()}],
+            ids=[f"{project_name}_checkpoint"]
         )
     
+    def load_checkpoint(self, project_name):
+        result = self.checkpoint_collection.get(ids=[f"{project_name}_checkpoint"])
+        if not result["documents"]:
+            return None
+        return json.loads(result["documents"][0])
+    
     def query_project_data(self, project_name, query, limit=5):
-        """Search across all collections for relevant information"""
+        """
+        Search across all collections for relevant information.
+        The query is embedded once and the collections are searched concurrently;
+        each result carries its search time in "elapsed_ms".
+        """
+        with get_tracer().span("db.query", query_bytes=len(query.encode("utf-8")), limit=limit) as span:
+            results, timings = self._query_collections(project_name, query, limit)
+            span.set("items", sum(len(result["documents"]) for result in results.values()))
+            span.set("collection_ms", {name: round(ms, 1) for name, ms in timings.items()})
+        return results
+    
+    def _query_collections(self, project_name, query, limit):
+        # Returns (results, {collection: search milliseconds}); timings are per call because
+        # the manager is shared by every session
         results = {}
         
         collections = [
@@ -122,20 +498,38 @@ class ChromaManager:
             ("tests", self.test_collection)
         ]
         
-        for name, collection in collections:
-            try:
-                result = collection.query(
-                    query_texts=[query],
-                    n_results=limit,
-                    where={"project": project_name}
-                )
-                
-                if result["documents"][0]:
-                    results[name] = {
-                        "documents": result["documents"][0],
-                        "metadatas": result["metadatas"][0]
-                    }
-            except Exception as e:
-                print(f"Error querying {name}: {str(e)}")
+        query_embedding = self.embedding_function([query])[0]
+        
+        # Only the latest version of each artifact is searched; older kept versions are history
+        where = {"project": project_name}
+        if self.load_manifest(project_name)["artifacts"]:
+            where = {"$and": [where, {"latest": True}]}
+        
+        def search(name, collection):
+            start = time.perf_counter()
+            result = collection.query(
+                query_embeddings=[query_embedding],
+                n_results=limit,
+                where=where
+            )
+            return result, (time.perf_counter() - start) * 1000
+        
+        timings = {}
+        with ThreadPoolExecutor(max_workers=len(collections)) as executor:
+            futures = [(name, executor.submit(search, name, collection)) for name, collection in collections]
+            
+            for name, future in futures:
+                try:
+                    result, elapsed_ms = future.result()
+                    timings[name] = elapsed_ms
+                    
+                    if result["documents"][0]:
+                        results[name] = {
+                            "documents": result["documents"][0],
+                            "metadatas": result["metadatas"][0],
+                            "elapsed_ms": elapsed_ms
+                        }
+                except Exception as e:
+                    print(f"Error querying {name}: {str(e)}")
         
-        return results
\ No newline at end of file
+        return results, timings
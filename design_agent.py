@@ -1,37 +1,52 @@
 import json
-from utils.conversation import LLMHandler
+from utils.registry import get_llm_handler
 from utils.templates import get_template
+from utils.prompt_builder import PromptBuilder, format_stories, summarize_stories
 
 class DesignAgent:
     def __init__(self):
-        self.llm = LLMHandler()
+        self.llm = get_llm_handler()
     
     def create_design(self, requirements, user_stories):
         """
         Create a system design document based on requirements and user stories
         """
+        prompt = self._build_prompt(requirements, user_stories)
+        
+        # Get response from LLM
+        design_doc = self.llm.get_response(prompt)
+        
+        return design_doc
+    
+    def stream_design(self, requirements, user_stories):
+        """
+        Create the design document, yielding text chunks as the model produces them
+        """
+        return self.llm.stream_response(self._build_prompt(requirements, user_stories))
+    
+    def _build_prompt(self, requirements, user_stories):
         # Get the design document template
         template = get_template("design_doc.md")
         
         # Prepare user stories for the prompt
-        stories_text = ""
-        for i, story in enumerate(user_stories):
-            stories_text += f"User Story #{i+1}: {story['title']}\n"
-            stories_text += f"As a {story['role']}, I want {story['want']} so that {story['so_that']}\n"
-            stories_text += "Acceptance Criteria:\n"
-            for criterion in story['acceptance_criteria']:
-                stories_text += f"- {criterion}\n"
-            stories_text += "\n"
+        stories_text = format_stories(user_stories)
+        
+        packed = (
+            PromptBuilder()
+            .add("requirements", requirements, priority=3)
+            .add("stories", stories_text, priority=2, summary=summarize_stories(user_stories))
+            .build()
+        )
         
         # Create the prompt for the LLM
-        prompt = f"""
+        return f"""
 You are a senior Software Architect responsible for creating a comprehensive system design document based on business requirements and user stories.
 
 THE HIGH-LEVEL BUSINESS REQUIREMENTS:
-{requirements}
+{packed['requirements']}
 
 THE USER STORIES:
-{stories_text}
+{packed['stories']}
 
 Based on this information, create a detailed design document that includes:
 
@@ -50,9 +65,4 @@ Be specific in your design choices and explain the rationale behind key architec
 Here's a template to help you get started, but feel free to modify it to best represent the system design:
 
 {template}
-"""
-        
-        # Get response from LLM
-        design_doc = self.llm.get_response(prompt)
-        
-        return design_doc
\ No newline at end of file
+"""
\ No newline at end of file
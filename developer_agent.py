@@ -1,99 +1,372 @@
+import os
+import re
 import json
-from utils.conversation import LLMHandler
+import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.registry import get_llm_handler
 from utils.templates import get_template
+from utils.json_stream import parse_json_array
+from utils.tracing import propagate
+from utils.chunking import markdown_sections
+from utils.prompt_builder import PromptBuilder, format_stories, summarize_markdown, summarize_stories
+
+# Header the model is asked to put before each file in a batched response
+BATCH_FILE_HEADER = re.compile(r"^#{2,3}\s*FILE:\s*`?([^\s`]+)`?\s*$", re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=8)
+def _packed_context(stories_json, design_doc):
+    # Fit the design document and stories into the prompt budget once per project version
+    user_stories = json.loads(stories_json)
+    return (
+        PromptBuilder()
+        .add("stories", format_stories(user_stories), priority=3, summary=summarize_stories(user_stories))
+        .add("design", design_doc, priority=2, summary=summarize_markdown)
+        .build()
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def _shared_prefix(stories_json, design_doc):
+    # Identical leading text for every file prompt of a project, so the inference
+    # server's prefix/KV cache can reuse it; only the instructions after it vary
+    packed = _packed_context(stories_json, design_doc)
+    template = get_template("code_template.py")
+    return f"""
+You are a senior Software Developer working on implementing a system based on the following design document and user stories.
+
+THE DESIGN DOCUMENT:
+{packed['design']}
+
+THE USER STORIES:
+{packed['stories']}
+
+Here's a code template to help you get started, but feel free to modify it:
+
+{template}
+"""
+
 
 class Developer:
-    def __init__(self):
-        self.llm = LLMHandler()
-    
-    def generate_code(self, user_stories, design_doc):
+    def __init__(self, concurrency=None, prompt_mode=None):
+        self.llm = get_llm_handler()
+        # Maximum number of file prompts in flight at once (1 = sequential)
+        self.concurrency = concurrency or int(os.getenv("DEVELOPER_CONCURRENCY", "4"))
+        # "per_file": one call per file sharing a cached prefix; "batched": several files per call
+        self.prompt_mode = prompt_mode or os.getenv("DEVELOPER_PROMPT_MODE", "per_file")
+        self.batch_size = int(os.getenv("DEVELOPER_BATCH_SIZE", "4"))
+
+    def generate_code(self, user_stories, design_doc, on_file_generated=None, traceability=None):
+        """
+        Generate code based on user stories and design document.
+        Files are generated concurrently; on_file_generated(filename, code) is called
+        from the calling thread as each file finishes. The returned dict keeps the
+        order of the planned file list regardless of completion order.
+        If a traceability dict is passed it is filled with the story/section map used by update_code.
+        """
+        files_list, file_sources = self.plan_project(user_stories, design_doc)
+        if traceability is not None:
+            traceability.clear()
+            traceability.update(self.build_traceability(files_list, file_sources, user_stories, design_doc))
+
+        generated = self._generate_files(files_list, user_stories, design_doc, on_file_generated)
+
+        # Preserve the planned file order
+        code_files = {filename: generated[filename] for filename in files_list}
+
+        return code_files
+
+    def update_code(self, user_stories, design_doc, code_files, traceability,
+                    changed_stories=None, changed_sections=None, on_file_generated=None):
+        """
+        Regenerate only the files affected by changed user stories or design sections.
+        Affected files are found from the traceability map recorded by generate_code: a file is
+        regenerated when a story or design section it was built from changed or disappeared.
+        Stories and sections no file was built from (added, or a renamed heading) are placed by
+        planning the project again; the files that plan assigns them to are regenerated or created.
+        changed_stories (story indices) and changed_sections (headings) force extra files to be
+        regenerated. Every other file is returned unchanged.
+        Returns (code_files, traceability, regenerated_filenames).
+        """
+        story_hashes = self._story_hashes(user_stories)
+        section_hashes = self._section_hashes(design_doc)
+        changed_stories = set(changed_stories or [])
+        changed_sections = set(changed_sections or [])
+
+        affected = []
+        for filename in code_files:
+            sources = traceability.get(filename)
+            if sources is None:
+                affected.append(filename)
+                continue
+
+            stale_story = any(
+                story_hashes.get(int(index)) != digest or int(index) in changed_stories
+                for index, digest in sources["stories"].items()
+            )
+            stale_section = any(
+                section_hashes.get(heading) != digest or heading in changed_sections
+                for heading, digest in sources["sections"].items()
+            )
+            if stale_story or stale_section:
+                affected.append(filename)
+
+        # The map only knows the stories and sections that existed at generation time
+        covered_stories = {int(index) for sources in traceability.values() for index in sources["stories"]}
+        covered_sections = {heading for sources in traceability.values() for heading in sources["sections"]}
+        new_stories = set(story_hashes) - covered_stories
+        new_sections = set(section_hashes) - covered_sections
+        planned = {}
+        if new_stories or new_sections:
+            files_list, file_sources = self.plan_project(user_stories, design_doc)
+            planned = self.build_traceability(files_list, file_sources, user_stories, design_doc)
+            for filename, sources in planned.items():
+                implements_new = (
+                    any(index in new_stories for index in sources["stories"])
+                    or any(heading in new_sections for heading in sources["sections"])
+                )
+                if implements_new and filename not in affected:
+                    affected.append(filename)
+
+        generated = self._generate_files(affected, user_stories, design_doc, on_file_generated)
+
+        updated_code = {filename: generated.get(filename, code) for filename, code in code_files.items()}
+        for filename in affected:
+            if filename not in updated_code and filename in generated:
+                updated_code[filename] = generated[filename]
+        updated_traceability = dict(traceability)
+        for filename in affected:
+            if filename in planned:
+                updated_traceability[filename] = planned[filename]
+                continue
+            sources = traceability.get(filename)
+            stories = [int(index) for index in sources["stories"]] if sources else list(story_hashes)
+            sections = list(sources["sections"]) if sources else list(section_hashes)
+            updated_traceability[filename] = {
+                "stories": {index: story_hashes[index] for index in stories if index in story_hashes},
+                "sections": {heading: section_hashes[heading] for heading in sections if heading in section_hashes}
+            }
+
+        return updated_code, updated_traceability, affected
+
+    def plan_project(self, user_stories, design_doc):
         """
-        Generate code based on user stories and design document
+        Ask the LLM which files need to be created and which user stories and design sections
+        each one implements. Returns (files_list, {filename: {"stories": [...], "sections": [...]}}).
         """
-        # Get the code template
-        template = get_template("code_template.py")
-        
-        # Prepare user stories for the prompt
-        stories_text = ""
-        for i, story in enumerate(user_stories):
-            stories_text += f"User Story #{i+1}: {story['title']}\n"
-            stories_text += f"As a {story['role']}, I want {story['want']} so that {story['so_that']}\n"
-            stories_text += "Acceptance Criteria:\n"
-            for criterion in story['acceptance_criteria']:
-                stories_text += f"- {criterion}\n"
-            stories_text += "\n"
-        
+        packed = _packed_context(json.dumps(user_stories, sort_keys=True), design_doc)
+        section_list = "\n".join(f"- {heading}" for heading in self._split_sections(design_doc))
+
         # Create the prompt for the LLM to identify required files
         files_prompt = f"""
 You are a senior Software Developer working on implementing a system based on the following design document and user stories.
 
 THE DESIGN DOCUMENT:
-{design_doc}
+{packed['design']}
 
 THE USER STORIES:
-{stories_text}
+{packed['stories']}
 
-First, identify all the Python files that need to be created for this project. 
-Your task is to list all the necessary files based on the design document and user stories.
+THE DESIGN DOCUMENT SECTIONS:
+{section_list}
 
-Format your response as a JSON array of filenames, for example:
+First, identify all the Python files that need to be created for this project.
+Your task is to list all the necessary files based on the design document and user stories,
+together with the user story numbers and design document sections each file implements.
+
+Format your response as a JSON array, for example:
 ```json
-["main.py", "database.py", "api.py", "models.py", "utils.py"]
+[
+  {{"filename": "main.py", "stories": [1, 2], "sections": ["Architecture"]}},
+  {{"filename": "database.py", "stories": [3], "sections": ["Data Model"]}}
+]
 ```
 
 Focus only on the core files needed for the application, considering the architecture described in the design document.
 """
-        
+
         # Get response from LLM for file list
         files_response = self.llm.get_response(files_prompt)
-        
-        # Extract the JSON array from the response
-        try:
-            # Try to find JSON in the response
-            json_start = files_response.find("[")
-            json_end = files_response.rfind("]") + 1
-            
-            if json_start >= 0 and json_end > json_start:
-                files_json = files_response[json_start:json_end]
-                files_list = json.loads(files_json)
+
+        # Entries may be plain filenames or objects carrying their traceability
+        files_list = []
+        file_sources = {}
+        for entry in parse_json_array(files_response):
+            if isinstance(entry, dict) and isinstance(entry.get("filename"), str):
+                filename = entry["filename"]
+                file_sources[filename] = entry
+            elif isinstance(entry, str):
+                filename = entry
             else:
-                # Fallback to a default list if JSON parsing fails
-                files_list = ["main.py", "database.py", "api.py", "models.py", "utils.py"]
-        except Exception as e:
-            print(f"Error parsing file list: {str(e)}")
-            # Fallback to a default list
+                continue
+            if filename not in files_list:
+                files_list.append(filename)
+
+        if not files_list:
+            # Fallback to a default list if no filenames could be parsed; the unusable
+            # response is dropped from the cache so the next run plans again
+            self.llm.invalidate(files_prompt)
             files_list = ["main.py", "database.py", "api.py", "models.py", "utils.py"]
-        
-        # Generate code for each file
-        code_files = {}
-        
+
+
+        return files_list, file_sources
+
+    def build_traceability(self, files_list, file_sources, user_stories, design_doc):
+        """
+        Record, per file, the hash of every story and design section it was generated from.
+        Files without a usable mapping are treated as depending on everything.
+        """
+        story_hashes = self._story_hashes(user_stories)
+        section_hashes = self._section_hashes(design_doc)
+        traceability = {}
+
         for filename in files_list:
-            # Create the prompt for the LLM to generate code for this file
-            code_prompt = f"""
-You are a senior Software Developer working on implementing a system based on the following design document and user stories.
+            sources = file_sources.get(filename, {})
+            stories = []
+            for number in sources.get("stories", []):
+                try:
+                    stories.append(int(number) - 1)
+                except (TypeError, ValueError):
+                    continue
+            stories = [index for index in stories if index in story_hashes]
+            sections = [heading for heading in sources.get("sections", []) if heading in section_hashes]
+            if not stories and not sections:
+                stories = list(story_hashes)
+                sections = list(section_hashes)
+            traceability[filename] = {
+                "stories": {index: story_hashes[index] for index in stories},
+                "sections": {heading: section_hashes[heading] for heading in sections}
+            }
 
-THE DESIGN DOCUMENT:
-{design_doc}
+        return traceability
 
-THE USER STORIES:
-{stories_text}
+    def _story_hashes(self, user_stories):
+        return {
+            i: hashlib.sha256(json.dumps(story, sort_keys=True).encode("utf-8")).hexdigest()
+            for i, story in enumerate(user_stories)
+        }
+
+    def _section_hashes(self, design_doc):
+        return {
+            heading: hashlib.sha256(body.encode("utf-8")).hexdigest()
+            for heading, body in self._split_sections(design_doc).items()
+        }
+
+    def _split_sections(self, design_doc):
+        # {heading: body} of a Markdown document; text before the first heading is "Overview"
+        lines = (design_doc or "").splitlines()
+        sections = {}
+        for _, heading, heading_line, last in markdown_sections(design_doc or ""):
+            body = "\n".join(lines[0 if heading_line is None else heading_line + 1:last + 1])
+            if heading_line is None and not body.strip():
+                continue
+            sections[heading] = sections[heading] + "\n" + body if heading in sections else body
+        return sections
 
+    def shared_prefix(self, user_stories, design_doc):
+        """
+        The prompt prefix common to every file of the project (design, stories and template)
+        """
+        return _shared_prefix(json.dumps(user_stories, sort_keys=True), design_doc)
+
+    def _code_prompt(self, filename, user_stories, design_doc):
+        # Create the prompt for the LLM to generate code for this file
+        return self.shared_prefix(user_stories, design_doc) + f"""
 You need to implement the file: {filename}
 
 Based on the design document and user stories, create the complete code for this file.
 Make sure your code is well-documented, follows best practices, and implements the functionality described in the design.
 
-Here's a template to help you get started, but feel free to modify it:
+DO NOT use placeholder comments like "// Implementation goes here". Provide the COMPLETE and WORKING implementation.
+"""
 
-{template}
+    def _batch_prompt(self, filenames, user_stories, design_doc):
+        # Create one prompt asking for several files, each introduced by a FILE header
+        file_list = "\n".join(f"- {filename}" for filename in filenames)
+        return self.shared_prefix(user_stories, design_doc) + f"""
+You need to implement the following files:
+{file_list}
+
+Based on the design document and user stories, create the complete code for each of these files.
+Make sure your code is well-documented, follows best practices, and implements the functionality described in the design.
+
+Start each file with a header line of the form "### FILE: <filename>" followed by the code in a ```python block.
 
 DO NOT use placeholder comments like "// Implementation goes here". Provide the COMPLETE and WORKING implementation.
 """
-            
-            # Get response from LLM for code
-            code = self.llm.get_response(code_prompt)
-            
-            # Add the code to the dictionary
-            code_files[filename] = code
-        
-        return code_files
\ No newline at end of file
+
+    def _generate_files(self, filenames, user_stories, design_doc, on_file_generated=None):
+        """
+        Generate code for the given files in the configured prompt mode
+        """
+        if self.prompt_mode != "batched" or len(filenames) < 2:
+            prompts = {
+                filename: self._code_prompt(filename, user_stories, design_doc)
+                for filename in filenames
+            }
+            return self._run_prompts(prompts, on_file_generated)
+
+        batches = [
+            tuple(filenames[start:start + self.batch_size])
+            for start in range(0, len(filenames), self.batch_size)
+        ]
+        prompts = {batch: self._batch_prompt(batch, user_stories, design_doc) for batch in batches}
+        generated = {}
+
+        def split_batch(batch, response):
+            files = self._split_batch_response(response)
+            for filename in batch:
+                if filename in files:
+                    generated[filename] = files[filename]
+                    if on_file_generated:
+                        on_file_generated(filename, files[filename])
+
+        self._run_prompts(prompts, split_batch)
+
+        # Files the model skipped in its batched answer get their own call
+        missing = [filename for filename in filenames if filename not in generated]
+        if missing:
+            prompts = {
+                filename: self._code_prompt(filename, user_stories, design_doc)
+                for filename in missing
+            }
+            generated.update(self._run_prompts(prompts, on_file_generated))
+
+        return generated
+
+    def _split_batch_response(self, response):
+        # Split a batched response on its "### FILE: name" headers
+        files = {}
+        matches = list(BATCH_FILE_HEADER.finditer(response))
+        for i, match in enumerate(matches):
+            end = matches[i + 1].start() if i + 1 < len(matches) else len(response)
+            files[match.group(1)] = response[match.end():end].strip()
+        return files
+
+    def _run_prompts(self, prompts, on_result=None):
+        """
+        Send independent prompts to the LLM over a bounded worker pool
+        """
+        results = {}
+        workers = max(1, min(self.concurrency, len(prompts)))
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = {
+                executor.submit(propagate(self.llm.get_response), prompt): key
+                for key, prompt in prompts.items()
+            }
+            for future in as_completed(futures):
+                key = futures[future]
+                results[key] = future.result()
+                if on_result:
+                    on_result(key, results[key])
+        except BaseException:
+            # A failed call or a cancelled job stops here: queued prompts are dropped instead of
+            # being sent, and calls already in flight are not waited for
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+        return results
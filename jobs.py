@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.tracing import propagate
+
+# Jobs run concurrently across all sessions and projects
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Minimum seconds between two stored partial results of the same job
+JOB_REPORT_INTERVAL = float(os.getenv("JOB_REPORT_INTERVAL", "0.5"))
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function that checks progress.check_cancelled() after being cancelled"""
+
+
+class JobProgress:
+    """
+    Handle passed to a job function for reporting partial results and checking for cancellation
+    """
+
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+        self.last_report = 0.0
+
+    def report(self, partial, message=None, force=False):
+        """
+        Store a partial result for the UI to show; calls closer together than JOB_REPORT_INTERVAL are dropped
+        """
+        now = time.monotonic()
+        if not force and now - self.last_report < JOB_REPORT_INTERVAL:
+            return
+        self.last_report = now
+        self.queue._update(self.job_id, partial=json.dumps(partial, default=str), message=message)
+
+    @property
+    def cancelled(self):
+        status = self.queue.status(self.job_id)
+        return status is None or status == "cancelled"
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(self.job_id)
+
+
+class JobQueue:
+    """
+    Background executor with a persistent job table in SQLite.
+    A job is identified by its project, kind and the fingerprint of its inputs, so a page reload
+    (or a second session) asking for the same work attaches to the existing job instead of
+    starting another one. Results and partial results are stored as JSON.
+    Jobs left queued or running by a previous process are marked failed on startup.
+    """
+
+    def __init__(self, path, workers=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers or JOB_WORKERS, thread_name_prefix="job")
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                project TEXT,
+                kind TEXT,
+                inputs TEXT,
+                status TEXT,
+                message TEXT,
+                partial TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL,
+                updated_at REAL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_lookup ON jobs(project, kind, inputs)")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS sessions (
+                project TEXT PRIMARY KEY,
+                state TEXT,
+                updated_at REAL
+            )"""
+        )
+        self._conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'Interrupted by a server restart' "
+            "WHERE status IN ('queued', 'running')"
+        )
+        self._conn.commit()
+
+    def submit(self, project, kind, inputs, fn):
+        """
+        Run fn(progress) in the background and return the job id.
+        If a job for the same project, kind and inputs is active or finished successfully, its id is
+        returned instead. fn must return a JSON-serialisable result.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE project = ? AND kind = ? AND inputs = ? "
+                "AND status IN ('queued', 'running', 'done') ORDER BY created_at DESC LIMIT 1",
+                (project, kind, inputs)
+            ).fetchone()
+            if row:
+                return row[0]
+
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            self._conn.execute(
+                "INSERT INTO jobs (id, project, kind, inputs, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, project, kind, inputs, now, now)
+            )
+            self._conn.commit()
+
+        self.executor.submit(propagate(self._run), job_id, fn)
+        return job_id
+
+    def _run(self, job_id, fn):
+        job = self.get(job_id)
+        if job is None or job["status"] != "queued":
+            return
+        self._update(job_id, status="running")
+        try:
+            result = fn(JobProgress(self, job_id))
+        except JobCancelled:
+            return
+        except Exception as e:
+            print(f"Job {job_id} failed: {str(e)}")
+            self._update(job_id, status="failed", error=str(e), only_active=True)
+            return
+        self._update(job_id, status="done", result=json.dumps(result, default=str), only_active=True)
+
+    def _update(self, job_id, only_active=False, **fields):
+        # only_active keeps a job that was cancelled meanwhile from being overwritten by its result
+        fields = {key: value for key, value in fields.items() if value is not None}
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        query = f"UPDATE jobs SET {assignments} WHERE id = ?"
+        if only_active:
+            query += " AND status IN ('queued', 'running')"
+        with self._lock:
+            self._conn.execute(query, list(fields.values()) + [job_id])
+            self._conn.commit()
+
+    def find(self, project, kind, inputs):
+        """
+        The most recent job for the same work in any status, or None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE project = ? AND kind = ? AND inputs = ? ORDER BY created_at DESC LIMIT 1",
+                (project, kind, inputs)
+            ).fetchone()
+        return self.get(row[0]) if row else None
+
+    def status(self, job_id):
+        """
+        The job's status alone, without decoding its partial result and result, or None
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, job_id):
+        """
+        Return the job as a dict with decoded "partial" and "result", or None
+        """
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
+        if row is None:
+            return None
+        job = dict(zip(columns, row))
+        for key in ("partial", "result"):
+            job[key] = json.loads(job[key]) if job[key] else None
+        return job
+
+    def cancel(self, job_id):
+        """
+        Mark a queued or running job cancelled. A running job stops at its next cancellation
+        check, and its result is discarded either way.
+        """
+        self._update(job_id, status="cancelled", only_active=True)
+
+    def save_session(self, project, state):
+        """
+        Persist a project's UI state so a reloaded page can pick up where it left off
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (project, state, updated_at) VALUES (?, ?, ?)",
+                (project, json.dumps(state, default=str), time.time())
+            )
+            self._conn.commit()
+
+    def load_session(self, project):
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM sessions WHERE project = ?", (project,)).fetchone()
+        return json.loads(row[0]) if row else None
@@ -0,0 +1,231 @@
+import re
+import ast
+import json
+from utils.tracing import get_tracer
+
+# Characters that can follow "[" when it really opens a JSON array (rules out "[INST]", "[1/3]" prose, ...)
+_ARRAY_START = re.compile(r'\[\s*([{\["\-0-9tfn\]])')
+
+
+def repair_json(text):
+    """
+    Fix common LLM glitches in a JSON fragment: smart quotes, raw newlines inside
+    strings and trailing commas before a closing bracket
+    """
+    text = text.replace("“", '"').replace("”", '"').replace("‘", "'").replace("’", "'")
+    out = []
+    in_string = False
+    escape = False
+    for char in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            elif char == "\n":
+                char = "\\n"
+            elif char == "\t":
+                char = "\\t"
+            out.append(char)
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "}]":
+            # Drop a trailing comma (and whitespace) before the closing bracket
+            j = len(out) - 1
+            while j >= 0 and out[j].isspace():
+                j -= 1
+            if j >= 0 and out[j] == ",":
+                del out[j]
+        out.append(char)
+    return "".join(out)
+
+
+def loads_lenient(text):
+    """
+    json.loads, then json.loads on the repaired text, then a Python literal
+    (single quotes, True/False/None). Raises ValueError if nothing works.
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    repaired = repair_json(text)
+    try:
+        return json.loads(repaired)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(repaired)
+    except (ValueError, SyntaxError) as e:
+        raise ValueError(f"Could not parse JSON item: {str(e)}")
+
+
+def validate_item(item, required=None, optional=None):
+    """
+    Check an item against a simple schema and normalise it.
+    For object items, required maps keys to types ({"title": str}) and optional maps keys to
+    (type, default) pairs; a string is accepted where a list is expected and wrapped in a list.
+    For scalar items, required is the expected type. Returns the item, or None if it does not match.
+    """
+    if required is None and optional is None:
+        return item
+    if isinstance(required, type):
+        return item if isinstance(item, required) else None
+    if not isinstance(item, dict):
+        return None
+
+    normalised = dict(item)
+    for key, expected in (required or {}).items():
+        value = normalised.get(key)
+        if expected is list and isinstance(value, str):
+            value = [value]
+        if not isinstance(value, expected) or (expected is str and not value.strip()):
+            return None
+        normalised[key] = value
+    for key, (expected, default) in (optional or {}).items():
+        value = normalised.get(key, default)
+        if expected is list and isinstance(value, str):
+            value = [value]
+        normalised[key] = value if isinstance(value, expected) else default
+    return normalised
+
+
+class JSONArrayStreamParser:
+    """
+    Incremental parser for a JSON array embedded in LLM output.
+    feed() accepts text chunks as they stream in and returns every array element that
+    completed in that chunk, so a malformed element only loses itself, and a response
+    cut off mid-array still yields the elements before the cut.
+    """
+
+    def __init__(self, required=None, optional=None):
+        self.required = required
+        self.optional = optional
+        self.buffer = ""
+        self.pos = 0
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.item_start = None
+        self.done = False
+        self.emitted = 0
+        self.errors = []
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        items = []
+        while self.pos < len(self.buffer) and not self.done:
+            if self.depth == 0:
+                if not self._find_array_start():
+                    break
+                continue
+
+            char = self.buffer[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1 and self.item_start is not None:
+                        # A string element of the top-level array
+                        self._emit(self.pos + 1, items)
+            elif char == '"':
+                self.in_string = True
+                if self.depth == 1:
+                    self.item_start = self.pos
+            elif char in "{[":
+                if self.depth == 1:
+                    self.item_start = self.pos
+                self.stack.append(char)
+            elif char in "}]":
+                # A mismatched bracket implicitly closes the inner containers it skips over,
+                # so one bad bracket spoils a single element rather than the rest of the array
+                opener = "{" if char == "}" else "["
+                while len(self.stack) > 1 and self.stack[-1] != opener:
+                    self.stack.pop()
+                self.stack.pop()
+                if self.depth == 1 and self.item_start is not None:
+                    self._emit(self.pos + 1, items)
+                elif self.depth == 0:
+                    # An array with no usable element was probably prose ("[1/3]"); keep looking
+                    self.done = self.emitted > 0
+            elif self.depth == 1 and char not in ", \t\r\n" and self.item_start is None:
+                # A bare scalar element (number, true/false/null)
+                end = self.pos
+                while end < len(self.buffer) and self.buffer[end] not in ",]":
+                    end += 1
+                if end == len(self.buffer):
+                    break
+                self.item_start = self.pos
+                self._emit(end, items)
+                self.pos = end
+                continue
+            self.pos += 1
+        return items
+
+    @property
+    def depth(self):
+        return len(self.stack)
+
+    def _find_array_start(self):
+        match = _ARRAY_START.search(self.buffer, self.pos)
+        if match is None:
+            # Keep a possible "[" at the end of the buffer for the next chunk
+            last = self.buffer.rfind("[", self.pos)
+            self.pos = last if last >= 0 and not self.buffer[last + 1:].strip() else len(self.buffer)
+            return False
+        self.pos = match.start() + 1
+        self.stack = ["["]
+        return True
+
+    def _emit(self, end, items):
+        fragment = self.buffer[self.item_start:end]
+        self.item_start = None
+        try:
+            item = loads_lenient(fragment)
+        except ValueError as e:
+            self.errors.append(str(e))
+            return
+        item = validate_item(item, self.required, self.optional)
+        if item is None:
+            self.errors.append(f"Item does not match the expected schema: {fragment[:100]}")
+            return
+        items.append(item)
+        self.emitted += 1
+
+
+def parse_json_array(text, required=None, optional=None):
+    """
+    Extract every valid element of the first JSON array in text
+    """
+    with get_tracer().span("json.parse", bytes=len(text.encode("utf-8"))) as span:
+        parser = JSONArrayStreamParser(required, optional)
+        items = parser.feed(text)
+        span.set("items", len(items))
+        span.set("parse_errors", len(parser.errors))
+    for error in parser.errors:
+        print(f"Skipping malformed JSON item: {error}")
+    return items
+
+
+def iter_json_array(chunks, required=None, optional=None):
+    """
+    Yield array elements from a stream of text chunks as soon as each one is complete
+    """
+    parser = JSONArrayStreamParser(required, optional)
+    # Spans the whole stream, so it includes the time spent waiting for chunks
+    span = get_tracer().start("json.stream_parse", activate=False)
+    try:
+        for chunk in chunks:
+            for item in parser.feed(chunk):
+                yield item
+    finally:
+        span.set("bytes", len(parser.buffer.encode("utf-8")))
+        span.set("items", parser.emitted)
+        span.set("parse_errors", len(parser.errors))
+        span.finish()
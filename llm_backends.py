@@ -0,0 +1,367 @@
+import os
+import json
+import asyncio
+import threading
+import weakref
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from utils.llm_resilience import LLMError, LLMRateLimitError, LLMUnavailableError, LLMResponseError
+
+# Connection pool settings shared by every backend in the process
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+
+_session = None
+_session_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_http_session():
+    """
+    Return the process-wide pooled requests session.
+    Connections are kept alive and reused, so only the first call to a host pays for the TCP/TLS handshake.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_SIZE,
+                    pool_maxsize=HTTP_POOL_SIZE,
+                    pool_block=True
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_async_client():
+    """
+    Return the pooled async HTTP client for the running event loop.
+    httpx clients are bound to the loop they were created on, so one client is kept per loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_SIZE,
+                max_keepalive_connections=HTTP_POOL_SIZE
+            )
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def _retry_after(response, body):
+    # Retry-After header in seconds, or the Inference API's model-loading estimate
+    header = response.headers.get("Retry-After")
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    if isinstance(body, dict) and body.get("estimated_time"):
+        return float(body["estimated_time"])
+    return None
+
+
+def check_response(response):
+    """
+    Raise a typed LLMError for a failed requests/httpx response
+    """
+    status = response.status_code
+    if status < 400:
+        return
+
+    try:
+        body = response.json()
+    except Exception:
+        body = response.text
+    retry_after = _retry_after(response, body)
+    detail = body.get("error", body) if isinstance(body, dict) else body
+    message = f"HTTP {status}: {str(detail)[:300]}"
+
+    if status == 429:
+        raise LLMRateLimitError(message, retry_after=retry_after, status_code=status)
+    if status >= 500 or status == 408:
+        raise LLMUnavailableError(message, retry_after=retry_after, status_code=status)
+    raise LLMResponseError(message, status_code=status)
+
+
+def translate_error(error):
+    """
+    Map transport and engine exceptions onto the LLMError hierarchy
+    """
+    if isinstance(error, LLMError):
+        return error
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                          httpx.TransportError)):
+        return LLMUnavailableError(f"{type(error).__name__}: {str(error)}")
+    return LLMResponseError(f"{type(error).__name__}: {str(error)}")
+
+
+def iter_sse_events(lines):
+    """
+    Decode the JSON payloads of a server-sent-events stream, stopping at [DONE]
+    """
+    for line in lines:
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        yield json.loads(data)
+
+
+class LLMBackend:
+    """
+    Inference engine interface used by LLMHandler.
+    params is a dict with max_tokens, temperature and top_p.
+    """
+    name = "base"
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def generate(self, prompt, params):
+        raise NotImplementedError
+
+    async def agenerate(self, prompt, params):
+        # Engines without a native async client run in a worker thread
+        return await asyncio.to_thread(self.generate, prompt, params)
+
+    def stream(self, prompt, params):
+        # Engines without streaming yield the whole completion at once
+        yield self.generate(prompt, params)
+
+
+class HuggingFaceBackend(LLMBackend):
+    """
+    Hosted Hugging Face Inference API
+    """
+    name = "huggingface"
+
+    def __init__(self, model_name):
+        super().__init__(model_name)
+        self.api_key = os.getenv("HUGGINGFACE_API_KEY")
+        self.api_url = os.getenv("HUGGINGFACE_API_URL", f"https://api-inference.huggingface.co/models/{model_name}")
+        self.timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+        if not self.api_key:
+            raise ValueError("HUGGINGFACE_API_KEY not found in environment variables")
+
+    def generate(self, prompt, params):
+        response = get_http_session().post(
+            self.api_url,
+            headers=self._headers(),
+            json=self._payload(prompt, params),
+            timeout=self.timeout
+        )
+        check_response(response)
+        return self._extract_text(response.json())
+
+    async def agenerate(self, prompt, params):
+        response = await get_async_client().post(
+            self.api_url,
+            headers=self._headers(),
+            json=self._payload(prompt, params)
+        )
+        check_response(response)
+        return self._extract_text(response.json())
+
+    def stream(self, prompt, params):
+        payload = self._payload(prompt, params)
+        payload["stream"] = True
+        with get_http_session().post(
+            self.api_url,
+            headers=self._headers(),
+            json=payload,
+            timeout=self.timeout,
+            stream=True
+        ) as response:
+            check_response(response)
+            for event in iter_sse_events(response.iter_lines(decode_unicode=True)):
+                if "error" in event:
+                    raise LLMUnavailableError(f"Stream error: {event['error']}")
+                token = event.get("token", {})
+                if token.get("special") or not token.get("text"):
+                    continue
+                yield token["text"]
+
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _payload(self, prompt, params):
+        return {
+            "inputs": prompt,
+            "parameters": {
+                "max_new_tokens": params["max_tokens"],
+                "temperature": params["temperature"],
+                "top_p": params["top_p"],
+                "do_sample": True
+            }
+        }
+
+    def _extract_text(self, result):
+        # Extract the generated text
+        if isinstance(result, list) and len(result) > 0 and "generated_text" in result[0]:
+            return result[0]["generated_text"].strip()
+        elif isinstance(result, dict) and "generated_text" in result:
+            return result["generated_text"].strip()
+        elif isinstance(result, dict) and "error" in result:
+            if "loading" in str(result["error"]).lower():
+                raise LLMUnavailableError(str(result["error"]), retry_after=result.get("estimated_time"))
+            raise LLMResponseError(str(result["error"]))
+        else:
+            raise LLMResponseError(f"Unexpected response from the Inference API: {str(result)[:300]}")
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    Local inference server exposing the OpenAI completions API (llama.cpp server, vLLM, TGI, Ollama)
+    """
+    name = "openai"
+
+    def __init__(self, model_name):
+        super().__init__(model_name)
+        self.base_url = os.getenv("LLM_BASE_URL", "http://localhost:8080/v1").rstrip("/")
+        self.api_key = os.getenv("LLM_API_KEY", "")
+        self.timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+    def generate(self, prompt, params):
+        response = get_http_session().post(
+            f"{self.base_url}/completions",
+            headers=self._headers(),
+            json=self._payload(prompt, params),
+            timeout=self.timeout
+        )
+        check_response(response)
+        return response.json()["choices"][0]["text"].strip()
+
+    async def agenerate(self, prompt, params):
+        response = await get_async_client().post(
+            f"{self.base_url}/completions",
+            headers=self._headers(),
+            json=self._payload(prompt, params)
+        )
+        check_response(response)
+        return response.json()["choices"][0]["text"].strip()
+
+    def stream(self, prompt, params):
+        payload = self._payload(prompt, params)
+        payload["stream"] = True
+        with get_http_session().post(
+            f"{self.base_url}/completions",
+            headers=self._headers(),
+            json=payload,
+            timeout=self.timeout,
+            stream=True
+        ) as response:
+            check_response(response)
+            for event in iter_sse_events(response.iter_lines(decode_unicode=True)):
+                text = event["choices"][0].get("text")
+                if text:
+                    yield text
+
+    def _headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def _payload(self, prompt, params):
+        return {
+            "model": self.model_name,
+            "prompt": prompt,
+            "max_tokens": params["max_tokens"],
+            "temperature": params["temperature"],
+            "top_p": params["top_p"],
+            # Lets llama.cpp keep the shared prompt prefix in its KV cache between requests
+            "cache_prompt": True
+        }
+
+
+_local_pipelines = {}
+_local_pipelines_lock = threading.Lock()
+
+
+class TransformersBackend(LLMBackend):
+    """
+    In-process CPU inference with a transformers text-generation pipeline.
+    The model is loaded once per process and shared by every handler.
+    Needs torch in addition to transformers: pip install -r requirements-transformers.txt
+    """
+    name = "transformers"
+
+    def __init__(self, model_name):
+        super().__init__(model_name)
+        self.generator = self._load(model_name)
+
+    @staticmethod
+    def _load(model_name):
+        with _local_pipelines_lock:
+            if model_name not in _local_pipelines:
+                from transformers import pipeline
+                _local_pipelines[model_name] = pipeline(
+                    "text-generation",
+                    model=model_name,
+                    device=int(os.getenv("LOCAL_MODEL_DEVICE", "-1"))
+                )
+            return _local_pipelines[model_name]
+
+    def generate(self, prompt, params):
+        result = self.generator(prompt, return_full_text=False, **self._generation_kwargs(params))
+        return result[0]["generated_text"].strip()
+
+    def stream(self, prompt, params):
+        from transformers import TextIteratorStreamer
+
+        streamer = TextIteratorStreamer(self.generator.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        inputs = self.generator.tokenizer(prompt, return_tensors="pt").to(self.generator.model.device)
+        worker = threading.Thread(
+            target=self.generator.model.generate,
+            kwargs=dict(inputs, streamer=streamer, **self._generation_kwargs(params))
+        )
+        worker.start()
+        for text in streamer:
+            if text:
+                yield text
+        worker.join()
+
+    def _generation_kwargs(self, params):
+        return {
+            "max_new_tokens": params["max_tokens"],
+            "temperature": params["temperature"],
+            "top_p": params["top_p"],
+            "do_sample": params["temperature"] > 0
+        }
+
+
+BACKENDS = {
+    HuggingFaceBackend.name: HuggingFaceBackend,
+    OpenAICompatibleBackend.name: OpenAICompatibleBackend,
+    TransformersBackend.name: TransformersBackend
+}
+
+
+def get_backend():
+    """
+    Build the backend selected by LLM_BACKEND (huggingface, openai or transformers)
+    """
+    name = os.getenv("LLM_BACKEND", "huggingface").lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND '{name}'. Expected one of: {', '.join(BACKENDS)}")
+
+    model_name = os.getenv("MODEL_NAME", "mistralai/Mixtral-8x7B-Instruct-v0.1")
+    if name != HuggingFaceBackend.name:
+        model_name = os.getenv("LOCAL_MODEL_NAME", model_name)
+    return BACKENDS[name](model_name)
@@ -0,0 +1,194 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class LLMError(Exception):
+    """
+    A generation failed. Raised instead of returning error text so that failures
+    are never parsed, cached or stored as artifacts.
+    """
+    retryable = False
+
+    def __init__(self, message, retry_after=None, status_code=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class LLMRateLimitError(LLMError):
+    """The backend rejected the request with 429 Too Many Requests"""
+    retryable = True
+
+
+class LLMUnavailableError(LLMError):
+    """The backend is loading the model, overloaded, timed out or unreachable"""
+    retryable = True
+
+
+class LLMResponseError(LLMError):
+    """The backend rejected the request or returned something that is not a completion"""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: rate tokens per second, bursts up to capacity
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take one token and return how many seconds the caller must wait before using it
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def aacquire(self):
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class RetryPolicy:
+    """
+    Bounded exponential backoff with jitter that honours the server's Retry-After / estimated_time
+    """
+
+    def __init__(self, max_retries=None, base_delay=None, max_delay=None):
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "4")) if max_retries is None else max_retries
+        self.base_delay = float(os.getenv("LLM_RETRY_BASE_DELAY", "1")) if base_delay is None else base_delay
+        self.max_delay = float(os.getenv("LLM_RETRY_MAX_DELAY", "60")) if max_delay is None else max_delay
+
+    def delay(self, attempt, error):
+        backoff = min(self.max_delay, self.base_delay * (2 ** attempt))
+        backoff = random.uniform(backoff / 2, backoff)
+        if error.retry_after:
+            return min(self.max_delay, max(backoff, error.retry_after))
+        return backoff
+
+    def call(self, fn, limiter=None):
+        attempt = 0
+        while True:
+            if limiter:
+                limiter.acquire()
+            try:
+                return fn()
+            except LLMError as e:
+                if not e.retryable or attempt >= self.max_retries:
+                    raise
+                wait = self.delay(attempt, e)
+                print(f"LLM call failed ({str(e)}), retrying in {wait:.1f}s")
+                time.sleep(wait)
+                attempt += 1
+
+    async def acall(self, fn, limiter=None):
+        attempt = 0
+        while True:
+            if limiter:
+                await limiter.aacquire()
+            try:
+                return await fn()
+            except LLMError as e:
+                if not e.retryable or attempt >= self.max_retries:
+                    raise
+                wait = self.delay(attempt, e)
+                print(f"LLM call failed ({str(e)}), retrying in {wait:.1f}s")
+                await asyncio.sleep(wait)
+                attempt += 1
+
+
+class RequestCoalescer:
+    """
+    Collapses concurrent identical requests: callers arriving while a request with the
+    same key is in flight wait for its result instead of issuing their own.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn):
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+        return future.result()
+
+    async def arun(self, key, fn):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            future = self._in_flight.get((loop, key))
+            leader = future is None
+            if leader:
+                future = loop.create_future()
+                self._in_flight[(loop, key)] = future
+
+        if not leader:
+            return await asyncio.shield(future)
+
+        try:
+            future.set_result(await fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._in_flight.pop((loop, key), None)
+        return future.result()
+
+
+_rate_limiter = None
+_coalescer = RequestCoalescer()
+_shared_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Process-wide token bucket shared by every agent (LLM_RATE_LIMIT_PER_MINUTE, LLM_RATE_LIMIT_BURST)
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _shared_lock:
+            if _rate_limiter is None:
+                per_minute = float(os.getenv("LLM_RATE_LIMIT_PER_MINUTE", "60"))
+                _rate_limiter = TokenBucket(
+                    rate=per_minute / 60.0,
+                    capacity=float(os.getenv("LLM_RATE_LIMIT_BURST", "10"))
+                )
+    return _rate_limiter
+
+
+def get_coalescer():
+    return _coalescer
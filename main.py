@@ -6,13 +6,19 @@ from agents.project_lead import ProjectLead
 from agents.business_analyst import BusinessAnalyst
 from agents.design_agent import DesignAgent
 from agents.developer_agent import Developer
-from agents.testing_agent import Tester
-from utils.database import ChromaManager
+from utils.registry import get_agent, get_db_manager, get_job_queue
+from utils.pipeline import build_default_pipeline
+from utils.llm_resilience import LLMError, LLMResponseError
+from contextlib import contextmanager
 from utils.templates import get_template
+from utils.tracing import get_tracer, set_project
+from utils.memory import new_memory_state
 
 # Initialize session state variables
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "chat_memory" not in st.session_state:
+    st.session_state.chat_memory = new_memory_state()
 if "project_name" not in st.session_state:
     st.session_state.project_name = ""
 if "requirements" not in st.session_state:
@@ -28,7 +34,222 @@ if "artifacts" not in st.session_state:
         "test_results": []
     }
 if "db_manager" not in st.session_state:
-    st.session_state.db_manager = ChromaManager()
+    st.session_state.db_manager = get_db_manager()
+if "artifact_manifest" not in st.session_state:
+    st.session_state.artifact_manifest = {}
+if "stage_jobs" not in st.session_state:
+    st.session_state.stage_jobs = {}
+if "speculative" not in st.session_state:
+    st.session_state.speculative = os.getenv("SPECULATIVE_PREFETCH", "false").lower() in ("1", "true", "yes")
+
+# Generation runs in background jobs so widget interactions and reloads do not interrupt it
+job_queue = get_job_queue()
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+
+# After a page reload, restore the project named in the URL together with its artifacts
+if not st.session_state.project_name and st.query_params.get("project"):
+    saved_session = job_queue.load_session(st.query_params["project"])
+    if saved_session:
+        st.session_state.project_name = st.query_params["project"]
+        for key, value in saved_session.items():
+            st.session_state[key] = value
+
+# Spans recorded during this run are attributed to the current project
+set_project(st.session_state.project_name)
+
+# Dependency-aware view over the session artifacts: stale stages are rebuilt on demand
+pipeline = build_default_pipeline(
+    st.session_state.artifacts,
+    st.session_state.artifact_manifest,
+    {"requirements": st.session_state.requirements},
+    on_record=lambda name, value: st.session_state.db_manager.store_artifact(
+        st.session_state.project_name, name, value
+    )
+)
+
+@contextmanager
+def report_llm_errors():
+    # Show failed generations as an error instead of storing them as artifacts
+    try:
+        yield
+    except LLMError as e:
+        st.error(f"The language model could not complete this step: {str(e)}. Please try again in a moment.")
+        st.stop()
+
+def persist_session():
+    # Saved per project so a reloaded page (?project=...) resumes where it left off
+    job_queue.save_session(st.session_state.project_name, {
+        "requirements": st.session_state.requirements,
+        "current_phase": st.session_state.current_phase,
+        "artifacts": st.session_state.artifacts,
+        "artifact_manifest": st.session_state.artifact_manifest,
+        "messages": st.session_state.messages,
+        "chat_memory": st.session_state.chat_memory
+    })
+
+def generate_user_stories_job(values, progress):
+    stories = []
+    for story in get_agent(BusinessAnalyst).stream_user_stories(values["requirements"]):
+        progress.check_cancelled()
+        stories.append(story)
+        progress.report(stories, message=f"{len(stories)} user stories written")
+    if not stories:
+        raise LLMResponseError("The Business Analyst returned no parsable user stories")
+    return {"user_stories": stories}
+
+def create_design_job(values, progress):
+    design_doc = ""
+    for chunk in get_agent(DesignAgent).stream_design(values["requirements"], values["user_stories"]):
+        progress.check_cancelled()
+        design_doc += chunk
+        progress.report(design_doc)
+    return {"design_doc": design_doc.strip()}
+
+def generate_code_job(values, progress):
+    developer = get_agent(Developer)
+    if values.get("code") and values.get("code_traceability"):
+        # Only regenerate the files traced to changed stories or design sections
+        code_files, traceability, regenerated = developer.update_code(
+            values["user_stories"], values["design_doc"], values["code"], values["code_traceability"]
+        )
+        return {"code_traceability": traceability, "code": code_files}
+
+    generated = {}
+    def report_file(filename, code):
+        progress.check_cancelled()
+        generated[filename] = code
+        progress.report(generated, message=f"{len(generated)} files written", force=True)
+
+    traceability = {}
+    code_files = developer.generate_code(
+        values["user_stories"],
+        values["design_doc"],
+        on_file_generated=report_file,
+        traceability=traceability
+    )
+    return {"code_traceability": traceability, "code": code_files}
+
+# Stages with partial results; the others run their pipeline compute function as is
+STAGE_JOBS = {
+    "user_stories": generate_user_stories_job,
+    "design_doc": create_design_job,
+    "code": generate_code_job
+}
+
+# Stage each phase displays, in pipeline order; speculative prefetch starts the one after the current phase's
+PHASE_TARGETS = {
+    "requirements": "user_stories",
+    "design": "design_doc",
+    "development": "code",
+    "testing": "test_cases"
+}
+STAGE_ORDER = ["user_stories", "design_doc", "code", "test_cases", "test_results"]
+
+JOB_LABELS = {
+    "user_stories": "Business Analyst is generating user stories",
+    "design_doc": "Design Agent is writing the design document",
+    "code": "Developer Agent is writing code",
+    "test_cases": "Testing Agent is creating test cases",
+    "test_results": "Testing Agent is executing tests"
+}
+
+def run_stage_job(target, show_partial=None, start=True):
+    """
+    Bring target up to date through background jobs, one stale stage at a time.
+    Jobs are keyed by the fingerprint of their inputs, so reruns, reloads and other sessions
+    attach to the job already running. While a job runs, its partial result is shown and the
+    page polls; a finished job's artifacts are committed to the pipeline.
+    With start=False an existing job is followed but no new one is started.
+    """
+    stale = pipeline.stale_stages(target)
+    if not stale:
+        return
+    name = stale[0]
+    project_name = st.session_state.project_name
+    inputs = pipeline.input_fingerprint(name)
+    job = job_queue.find(project_name, name, inputs)
+
+    if job is not None and job["status"] == "failed":
+        st.error(f"The language model could not complete this step: {job['error']}")
+        if not st.button("Retry", key=f"retry_{target}"):
+            return
+        job = None
+        start = True
+
+    if job is None or job["status"] == "cancelled":
+        if not start:
+            return
+        job = job_queue.get(start_stage_job(name))
+
+    if job["status"] == "done":
+        # Non-stage artifacts (code traceability) first, then the stage artifacts
+        for artifact, value in job["result"].items():
+            if artifact not in pipeline.stages:
+                st.session_state.artifacts[artifact] = value
+        for artifact, value in job["result"].items():
+            if artifact in pipeline.stages:
+                pipeline.record(artifact, value)
+        persist_session()
+        st.rerun()
+
+    if show_partial and name == target and job["partial"]:
+        show_partial(job["partial"])
+    with st.spinner(f"{JOB_LABELS.get(name, name)}... {job['message'] or ''}"):
+        time.sleep(JOB_POLL_SECONDS)
+    st.rerun()
+
+def start_stage_job(name):
+    """
+    Submit the job computing stage name from the current artifacts and return its id.
+    The job is remembered so it can be cancelled if its inputs change before it finishes.
+    """
+    inputs = pipeline.input_fingerprint(name)
+    values = pipeline.values()
+    compute = STAGE_JOBS.get(name)
+    if compute is None:
+        run = lambda progress: {name: pipeline.stages[name].compute(values)}
+    else:
+        run = lambda progress: compute(values, progress)
+    job_id = job_queue.submit(st.session_state.project_name, name, inputs, run)
+    st.session_state.stage_jobs[name] = {"id": job_id, "inputs": inputs}
+    return job_id
+
+def cancel_outdated_jobs():
+    # Jobs whose stage inputs changed since they were started can only produce stale artifacts
+    for name, started in list(st.session_state.stage_jobs.items()):
+        if started["inputs"] != pipeline.input_fingerprint(name):
+            job_queue.cancel(started["id"])
+            del st.session_state.stage_jobs[name]
+
+def prefetch_next_stage(phase):
+    """
+    Speculatively start the stage after the phase's own once every input it needs is final.
+    Its result is only committed when the user opens the phase that shows it.
+    """
+    target = PHASE_TARGETS.get(phase)
+    if target is None or pipeline.is_stale(target):
+        return
+    next_stage = STAGE_ORDER[STAGE_ORDER.index(target) + 1]
+    stale = pipeline.stale_stages(next_stage)
+    if stale == [next_stage] and job_queue.find(
+        st.session_state.project_name, next_stage, pipeline.input_fingerprint(next_stage)
+    ) is None:
+        start_stage_job(next_stage)
+
+def show_user_stories(user_stories):
+    for i, story in enumerate(user_stories):
+        with st.expander(f"User Story #{i+1}: {story['title']}", expanded=i==0):
+            st.markdown(f"**As a** {story['role']}")
+            st.markdown(f"**I want** {story['want']}")
+            st.markdown(f"**So that** {story['so_that']}")
+            st.markdown("**Acceptance Criteria:**")
+            for criterion in story['acceptance_criteria']:
+                st.markdown(f"- {criterion}")
+
+def show_code_files(code_files):
+    for filename, code in code_files.items():
+        with st.expander(filename, expanded=False):
+            st.code(code)
 
 # App layout and styling
 st.set_page_config(page_title="AI Development Pod", layout="wide")
@@ -49,11 +270,18 @@ with st.sidebar:
                     st.session_state.project_name, 
                     st.session_state.requirements
                 )
+                st.query_params["project"] = st.session_state.project_name
+                persist_session()
                 st.rerun()
             else:
                 st.error("Please provide both project name and requirements")
     else:
         st.write(f"**Project:** {st.session_state.project_name}")
+        st.session_state.speculative = st.toggle(
+            "Speculative prefetch",
+            value=st.session_state.speculative,
+            help="Start generating the next phase in the background while you review this one"
+        )
         
         # Navigation buttons for different phases
         phases = ["requirements", "design", "development", "testing", "chat"]
@@ -83,6 +311,9 @@ with st.sidebar:
                     st.session_state.current_phase = phase
                     st.rerun()
 
+# In-flight work made obsolete by edits is cancelled before anything new is started
+cancel_outdated_jobs()
+
 # Main area based on current phase
 if st.session_state.current_phase == "requirements":
     st.header("Requirements Analysis")
@@ -90,25 +321,21 @@ if st.session_state.current_phase == "requirements":
     with st.expander("Business Requirements", expanded=True):
         st.write(st.session_state.requirements)
     
-    with st.spinner("Business Analyst is generating user stories..."):
-        if not st.session_state.artifacts["user_stories"]:
-            ba_agent = BusinessAnalyst()
-            user_stories = ba_agent.generate_user_stories(st.session_state.requirements)
-            st.session_state.artifacts["user_stories"] = user_stories
-            st.session_state.db_manager.store_user_stories(
+    with st.expander("Edit Requirements", expanded=False):
+        edited_requirements = st.text_area("High-Level Business Requirements", value=st.session_state.requirements, height=200)
+        if st.button("Update Requirements") and edited_requirements != st.session_state.requirements:
+            # Downstream artifacts become stale and are rebuilt when their phase is visited
+            st.session_state.requirements = edited_requirements
+            st.session_state.db_manager.store_requirements(
                 st.session_state.project_name, 
-                user_stories
+                edited_requirements
             )
+            persist_session()
+            st.rerun()
     
     st.subheader("User Stories")
-    for i, story in enumerate(st.session_state.artifacts["user_stories"]):
-        with st.expander(f"User Story #{i+1}: {story['title']}", expanded=i==0):
-            st.markdown(f"**As a** {story['role']}")
-            st.markdown(f"**I want** {story['want']}")
-            st.markdown(f"**So that** {story['so_that']}")
-            st.markdown("**Acceptance Criteria:**")
-            for criterion in story['acceptance_criteria']:
-                st.markdown(f"- {criterion}")
+    run_stage_job("user_stories", show_partial=show_user_stories)
+    show_user_stories(st.session_state.artifacts["user_stories"])
 
 elif st.session_state.current_phase == "design":
     st.header("System Design")
@@ -117,21 +344,12 @@ elif st.session_state.current_phase == "design":
         for i, story in enumerate(st.session_state.artifacts["user_stories"]):
             st.markdown(f"**User Story #{i+1}:** {story['title']}")
     
-    with st.spinner("Design Agent is creating system design..."):
-        if not st.session_state.artifacts["design_doc"]:
-            design_agent = DesignAgent()
-            design_doc = design_agent.create_design(
-                st.session_state.requirements,
-                st.session_state.artifacts["user_stories"]
-            )
-            st.session_state.artifacts["design_doc"] = design_doc
-            st.session_state.db_manager.store_design_doc(
-                st.session_state.project_name, 
-                design_doc
-            )
-    
     st.subheader("System Design Document")
-    st.markdown(st.session_state.artifacts["design_doc"])
+    if pipeline.is_stale("design_doc"):
+        # The document appears as the Design Agent writes it
+        run_stage_job("design_doc", show_partial=st.markdown)
+    else:
+        st.markdown(st.session_state.artifacts["design_doc"])
 
 elif st.session_state.current_phase == "development":
     st.header("Development")
@@ -149,25 +367,12 @@ elif st.session_state.current_phase == "development":
                 st.markdown(st.session_state.artifacts["design_doc"])
     
     with tab2:
-        if not st.session_state.artifacts["code"]:
+        if pipeline.is_stale("code"):
             st.subheader("Generating Code")
-            with st.spinner("Developer Agent is writing code..."):
-                dev_agent = Developer()
-                code_files = dev_agent.generate_code(
-                    st.session_state.artifacts["user_stories"],
-                    st.session_state.artifacts["design_doc"]
-                )
-                st.session_state.artifacts["code"] = code_files
-                st.session_state.db_manager.store_code(
-                    st.session_state.project_name, 
-                    code_files
-                )
-                st.rerun()
+            run_stage_job("code", show_partial=show_code_files)
         else:
             st.subheader("Generated Code")
-            for filename, code in st.session_state.artifacts["code"].items():
-                with st.expander(filename, expanded=False):
-                    st.code(code)
+            show_code_files(st.session_state.artifacts["code"])
 
 elif st.session_state.current_phase == "testing":
     st.header("Testing")
@@ -188,21 +393,9 @@ elif st.session_state.current_phase == "testing":
                     st.markdown(f"**{filename}**")
     
     with tab2:
-        if not st.session_state.artifacts["test_cases"]:
+        if pipeline.is_stale("test_cases"):
             st.subheader("Generating Test Cases")
-            with st.spinner("Testing Agent is creating test cases..."):
-                test_agent = Tester()
-                test_cases = test_agent.create_test_cases(
-                    st.session_state.artifacts["user_stories"],
-                    st.session_state.artifacts["design_doc"],
-                    st.session_state.artifacts["code"]
-                )
-                st.session_state.artifacts["test_cases"] = test_cases
-                st.session_state.db_manager.store_test_cases(
-                    st.session_state.project_name, 
-                    test_cases
-                )
-                st.rerun()
+            run_stage_job("test_cases")
         else:
             st.subheader("Test Cases")
             for i, test in enumerate(st.session_state.artifacts["test_cases"]):
@@ -214,20 +407,9 @@ elif st.session_state.current_phase == "testing":
                     st.markdown(f"**Expected Result:** {test['expected_result']}")
     
     with tab3:
-        if not st.session_state.artifacts["test_results"]:
-            if st.button("Execute Tests"):
-                with st.spinner("Testing Agent is executing tests..."):
-                    test_agent = Tester()
-                    test_results = test_agent.execute_tests(
-                        st.session_state.artifacts["test_cases"],
-                        st.session_state.artifacts["code"]
-                    )
-                    st.session_state.artifacts["test_results"] = test_results
-                    st.session_state.db_manager.store_test_results(
-                        st.session_state.project_name, 
-                        test_results
-                    )
-                    st.rerun()
+        if pipeline.is_stale("test_results"):
+            # Started on request; a job already running for these inputs is followed
+            run_stage_job("test_results", start=st.button("Execute Tests"))
         else:
             st.subheader("Test Results")
             
@@ -241,14 +423,14 @@ elif st.session_state.current_phase == "testing":
             col3.metric("Pass Rate", f"{pass_rate:.1f}%")
             
             for i, result in enumerate(st.session_state.artifacts["test_results"]):
-                status_color = "green" if result["status"] == "PASS" else "red"
+                status_color = {"PASS": "green", "FAIL": "red"}.get(result["status"], "orange")
                 with st.expander(
                     f"Test #{i+1}: {result['title']} - {result['status']}", 
                     expanded=(result["status"] == "FAIL")
                 ):
                     st.markdown(f"**Status:** :{status_color}[{result['status']}]")
                     st.markdown(f"**Description:** {result['description']}")
-                    if result["status"] == "FAIL":
+                    if result["status"] != "PASS":
                         st.markdown(f"**Error Details:** {result['details']}")
 
 elif st.session_state.current_phase == "chat":
@@ -268,15 +450,46 @@ elif st.session_state.current_phase == "chat":
         
         # Generate project lead response
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                project_lead = ProjectLead()
-                response = project_lead.respond(
+            with report_llm_errors():
+                project_lead = get_agent(ProjectLead)
+                response = st.write_stream(project_lead.stream_respond(
                     prompt,
                     st.session_state.project_name,
                     st.session_state.requirements,
-                    st.session_state.artifacts
-                )
-                st.write(response)
+                    st.session_state.artifacts,
+                    history=st.session_state.messages[:-1],
+                    memory_state=st.session_state.chat_memory
+                )).strip()
         
         # Add assistant response to chat history
-        st.session_state.messages.append({"role": "assistant", "content": response})
\ No newline at end of file
+        st.session_state.messages.append({"role": "assistant", "content": response})
+
+# Look one phase ahead once this phase's artifacts are final, if enabled
+if st.session_state.project_name and st.session_state.speculative:
+    prefetch_next_stage(st.session_state.current_phase)
+
+# Keep the saved session current with navigation and chat history
+if st.session_state.project_name and st.session_state.current_phase != "setup":
+    persist_session()
+
+# Per-project timing panel, rendered last so it includes the calls made in this run
+if st.session_state.project_name:
+    with st.sidebar:
+        with st.expander("Timings"):
+            tracer = get_tracer()
+            project = st.session_state.project_name
+            rows = tracer.summary(project)
+            if rows:
+                st.dataframe(rows, hide_index=True)
+            else:
+                st.caption("No calls recorded yet")
+            st.download_button(
+                "Export trace (JSONL)",
+                tracer.export_jsonl(project),
+                file_name=f"{project}_trace.jsonl"
+            )
+            st.download_button(
+                "Export metrics (Prometheus)",
+                tracer.export_prometheus(project),
+                file_name=f"{project}_metrics.prom"
+            )
\ No newline at end of file
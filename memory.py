@@ -0,0 +1,109 @@
+import os
+from utils.llm_resilience import LLMError
+from utils.prompt_builder import PromptBuilder, truncate_to_tokens
+
+# Most recent question/answer turns kept verbatim in the chat prompt
+CHAT_MEMORY_TURNS = int(os.getenv("CHAT_MEMORY_TURNS", "4"))
+# Token budget for everything the memory adds to a chat prompt
+CHAT_MEMORY_TOKEN_BUDGET = int(os.getenv("CHAT_MEMORY_TOKEN_BUDGET", "1500"))
+# Length the rolling summary is kept under
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))
+# Earlier answers retrieved from the conversations collection by similarity
+CHAT_RECALL_LIMIT = int(os.getenv("CHAT_RECALL_LIMIT", "3"))
+
+
+def new_memory_state():
+    """
+    Per-conversation memory state: the rolling summary and how many messages it covers
+    """
+    return {"summary": "", "summarized": 0}
+
+
+def _speaker(message):
+    return "Team member" if message["role"] == "user" else "Project Lead"
+
+
+class ConversationMemory:
+    """
+    Chat memory of constant size: the last CHAT_MEMORY_TURNS turns verbatim, older turns folded
+    into an incrementally updated summary, and relevant earlier answers recalled from ChromaDB,
+    all packed into CHAT_MEMORY_TOKEN_BUDGET.
+    messages is the chat history as [{"role": "user" | "assistant", "content": ...}].
+    """
+
+    def __init__(self, llm, db, recent_turns=None, budget=None):
+        self.llm = llm
+        self.db = db
+        self.recent_turns = recent_turns or CHAT_MEMORY_TURNS
+        self.budget = budget or CHAT_MEMORY_TOKEN_BUDGET
+
+    def context(self, project_name, question, messages, state):
+        """
+        Memory text for a chat prompt about question
+        """
+        messages = messages or []
+        state = state or new_memory_state()
+        builder = PromptBuilder(budget=self.budget, reserve=0)
+
+        # Verbatim turns not yet folded into the summary; recalled answers are cut first,
+        # then the oldest turns, and the compact summary last
+        recent = messages[state["summarized"]:]
+        if state["summary"]:
+            builder.add(
+                "summary",
+                f"Summary of the earlier conversation:\n{state['summary']}",
+                priority=3 + len(recent)
+            )
+
+        for i, message in enumerate(recent):
+            builder.add(f"turn:{i}", f"{_speaker(message)}: {message['content']}", priority=3 + i)
+
+        # Earlier answers on the same topic, including ones from previous sessions
+        recent_text = {message["content"] for message in recent}
+        for i, recalled in enumerate(self.db.query_conversations(project_name, question, limit=CHAT_RECALL_LIMIT)):
+            if recalled["answer"] in recent_text:
+                continue
+            builder.add(
+                f"recall:{i}",
+                f"Earlier question: {recalled['question']}\nEarlier answer: {recalled['answer']}",
+                priority=1
+            )
+
+        packed = builder.build()
+        return "\n\n".join(text for text in packed.values() if text)
+
+    def update(self, messages, state):
+        """
+        Fold the turns that left the verbatim window into the rolling summary.
+        Only the newly evicted turns are summarised, so each update costs one small call.
+        """
+        keep_from = max(0, len(messages) - 2 * self.recent_turns)
+        if keep_from <= state["summarized"]:
+            return state
+
+        evicted = "\n".join(
+            f"{_speaker(message)}: {truncate_to_tokens(message['content'], CHAT_SUMMARY_TOKENS)}"
+            for message in messages[state["summarized"]:keep_from]
+        )
+        prompt = f"""
+You maintain the running summary of a conversation between a team member and the Project Lead of a software project.
+
+CURRENT SUMMARY:
+{state['summary'] or '(empty)'}
+
+NEW EXCHANGES TO ADD:
+{evicted}
+
+Rewrite the summary so it also covers the new exchanges. Keep decisions, facts, open questions and names.
+Write at most {CHAT_SUMMARY_TOKENS * 3 // 4} words of plain prose and nothing else.
+"""
+        try:
+            summary = self.llm.get_response(prompt)
+        except LLMError as e:
+            # The turns stay verbatim (and are cut by the budget) until the next update succeeds
+            print(f"Error updating the conversation summary: {str(e)}")
+            return state
+
+        state["summary"] = truncate_to_tokens(summary.strip(), CHAT_SUMMARY_TOKENS)
+        state["summarized"] = keep_from
+        return state
@@ -0,0 +1,154 @@
+import json
+import hashlib
+
+
+def content_hash(value):
+    """
+    Stable SHA-256 of any JSON-serialisable artifact
+    """
+    payload = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class Stage:
+    def __init__(self, name, inputs, compute):
+        """
+        name: artifact produced by the stage
+        inputs: names of the artifacts (or source values) it is derived from
+        compute: function taking the current values dict and returning the new artifact
+        """
+        self.name = name
+        self.inputs = inputs
+        self.compute = compute
+
+
+class ArtifactPipeline:
+    """
+    Dependency-aware artifact pipeline.
+    The manifest records, for every produced artifact, the hash of the inputs it was built from.
+    An artifact is stale when it has never been built, when any upstream artifact is stale, or when
+    the current hash of its inputs differs from the recorded one. Only stale stages are recomputed,
+    and a recomputed artifact whose content did not change leaves its dependants fresh.
+    """
+
+    def __init__(self, stages, artifacts, manifest, sources=None, on_record=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.order = [stage.name for stage in stages]
+        self.artifacts = artifacts
+        self.manifest = manifest
+        self.sources = sources or {}
+        self.on_record = on_record
+
+    def value(self, name):
+        if name in self.sources:
+            return self.sources[name]
+        return self.artifacts.get(name)
+
+    def values(self):
+        values = dict(self.artifacts)
+        values.update(self.sources)
+        return values
+
+    def input_fingerprint(self, name):
+        stage = self.stages[name]
+        return content_hash([[dep, content_hash(self.value(dep))] for dep in stage.inputs])
+
+    def is_stale(self, name):
+        stage = self.stages[name]
+        if any(self.is_stale(dep) for dep in stage.inputs if dep in self.stages):
+            return True
+        entry = self.manifest.get(name)
+        return entry is None or entry["inputs"] != self.input_fingerprint(name)
+
+    def upstream(self, name):
+        """
+        All stages name depends on, in pipeline order
+        """
+        needed = set()
+        pending = [dep for dep in self.stages[name].inputs if dep in self.stages]
+        while pending:
+            dep = pending.pop()
+            if dep not in needed:
+                needed.add(dep)
+                pending.extend(d for d in self.stages[dep].inputs if d in self.stages)
+        return [stage for stage in self.order if stage in needed]
+
+    def stale_stages(self, target=None):
+        names = self.order if target is None else self.upstream(target) + [target]
+        return [name for name in names if self.is_stale(name)]
+
+    def record(self, name, value):
+        """
+        Store a freshly computed artifact and the fingerprint of the inputs it was built from
+        """
+        self.artifacts[name] = value
+        self.manifest[name] = {
+            "inputs": self.input_fingerprint(name),
+            "hash": content_hash(value)
+        }
+        if self.on_record:
+            self.on_record(name, value)
+
+    def refresh_inputs(self, name):
+        """
+        Bring every stale upstream stage of name up to date without computing name itself
+        """
+        for dep in self.upstream(name):
+            if self.is_stale(dep):
+                self.record(dep, self.stages[dep].compute(self.values()))
+
+    def run(self, target=None):
+        """
+        Recompute the stale stages needed for target (or the whole pipeline) and return the artifacts
+        """
+        for name in self.stale_stages(target):
+            # Re-check: an earlier recompute may have produced identical content
+            if self.is_stale(name):
+                self.record(name, self.stages[name].compute(self.values()))
+        return self.artifacts
+
+
+def build_default_pipeline(artifacts, manifest, sources, on_record=None):
+    """
+    The BA -> Design -> Developer -> Tester pipeline over the standard artifact names
+    """
+    from agents.business_analyst import BusinessAnalyst
+    from agents.design_agent import DesignAgent
+    from agents.developer_agent import Developer
+    from agents.testing_agent import Tester
+    from utils.registry import get_agent
+
+    def generate_code(values):
+        # Regenerate only the files affected by the change when a previous build is available
+        developer = get_agent(Developer)
+        previous_code = values.get("code")
+        traceability = values.get("code_traceability")
+        if previous_code and traceability:
+            code_files, traceability, _ = developer.update_code(
+                values["user_stories"], values["design_doc"], previous_code, traceability
+            )
+        else:
+            traceability = {}
+            code_files = developer.generate_code(
+                values["user_stories"], values["design_doc"], traceability=traceability
+            )
+        artifacts["code_traceability"] = traceability
+        return code_files
+
+    stages = [
+        Stage("user_stories", ["requirements"], lambda v: get_agent(BusinessAnalyst).generate_user_stories(
+            v["requirements"]
+        )),
+        Stage("design_doc", ["requirements", "user_stories"], lambda v: get_agent(DesignAgent).create_design(
+            v["requirements"], v["user_stories"]
+        )),
+        Stage("code", ["user_stories", "design_doc"], generate_code),
+        Stage("test_cases", ["user_stories", "design_doc", "code"], lambda v: get_agent(Tester).create_test_cases(
+            v["user_stories"], v["design_doc"], v["code"]
+        )),
+        Stage("test_results", ["test_cases", "code"], lambda v: get_agent(Tester).execute_tests(
+            v["test_cases"], v["code"]
+        ))
+    ]
+
+    return ArtifactPipeline(stages, artifacts, manifest, sources=sources, on_record=on_record)
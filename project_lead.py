@@ -1,20 +1,136 @@
-from utils.conversation import LLMHandler
-from utils.database import ChromaManager
+import os
+import re
+from utils.registry import get_llm_handler, get_db_manager
+from utils.prompt_builder import PromptBuilder, summarize_markdown
+from utils.memory import ConversationMemory
+from utils.pipeline import content_hash
+from utils.chat_router import route_question
+from utils.tracing import get_tracer
+
+# Token budget for the artifact context pasted into each chat prompt
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "4000"))
+# Design and code chunks retrieved for each chat question
+CHAT_RETRIEVAL_TOP_K = int(os.getenv("CHAT_RETRIEVAL_TOP_K", "8"))
+# Cosine similarity above which an earlier answer to the same question is reused; 0 disables the cache
+CHAT_CACHE_SIMILARITY = float(os.getenv("CHAT_CACHE_SIMILARITY", "0.97"))
+
+# Words that make a question refer back to the conversation ("Why?", "Tell me more about that")
+FOLLOW_UP_WORDS = re.compile(
+    r"\b(it|its|that|this|these|those|they|them|their|why|more|else|same|above|previous|earlier|again|also|instead)\b",
+    re.IGNORECASE
+)
+
+
+def depends_on_history(question, history):
+    """
+    Whether a question only makes sense together with the earlier turns, in which case
+    its answer is neither taken from nor added to the answer cache
+    """
+    if not history:
+        return False
+    return len(question.split()) < 4 or bool(FOLLOW_UP_WORDS.search(question))
+
+
+def artifact_version(requirements, artifacts):
+    """
+    Stamp of the requirements and artifacts an answer is based on; any regeneration or edit changes it
+    """
+    return content_hash({"requirements": requirements, "artifacts": artifacts})
+
 
 class ProjectLead:
-    def __init__(self):
-        self.llm = LLMHandler()
-        self.db = ChromaManager()
+    def __init__(self, db=None):
+        self.llm = get_llm_handler()
+        # Reuse the process-wide ChromaDB client instead of opening a new one per message
+        self.db = db or get_db_manager()
+        self.memory = ConversationMemory(self.llm, self.db)
+    
+    def respond(self, question, project_name, requirements, artifacts, history=None, memory_state=None):
+        """
+        Respond to a question about the project.
+        history is the earlier chat as [{"role", "content"}] messages; memory_state (see
+        utils.memory.new_memory_state) holds its rolling summary and is updated in place.
+        """
+        version = artifact_version(requirements, artifacts)
+        cacheable = not depends_on_history(question, history)
+        shortcut = self._answer_without_llm(question, project_name, artifacts, version, cacheable)
+        if shortcut is not None:
+            self._remember(question, shortcut, history, memory_state)
+            return shortcut
+        
+        prompt = self._build_prompt(question, project_name, requirements, artifacts, history, memory_state)
+        
+        # Get response from LLM
+        response = self.llm.get_response(prompt)
+        
+        # Store the conversation in the database
+        self.db.store_conversation(project_name, question, response)
+        if cacheable and CHAT_CACHE_SIMILARITY > 0:
+            self.db.store_cached_answer(project_name, question, response, version)
+        self._remember(question, response, history, memory_state)
+        
+        return response
     
-    def respond(self, question, project_name, requirements, artifacts):
+    def stream_respond(self, question, project_name, requirements, artifacts, history=None, memory_state=None):
         """
-        Respond to a question about the project
+        Respond to a question about the project, yielding the answer in chunks as it is generated
         """
+        version = artifact_version(requirements, artifacts)
+        cacheable = not depends_on_history(question, history)
+        shortcut = self._answer_without_llm(question, project_name, artifacts, version, cacheable)
+        if shortcut is not None:
+            yield shortcut
+            self._remember(question, shortcut, history, memory_state)
+            return
+        
+        prompt = self._build_prompt(question, project_name, requirements, artifacts, history, memory_state)
+        
+        chunks = []
+        for chunk in self.llm.stream_response(prompt):
+            chunks.append(chunk)
+            yield chunk
+        
+        # Store the conversation once the full answer is known
+        response = "".join(chunks).strip()
+        self.db.store_conversation(project_name, question, response)
+        if cacheable and CHAT_CACHE_SIMILARITY > 0:
+            self.db.store_cached_answer(project_name, question, response, version)
+        self._remember(question, response, history, memory_state)
+    
+    def _answer_without_llm(self, question, project_name, artifacts, version, cacheable):
+        # Factual questions (pass rate, failed tests, user story N, ...) are answered from the artifacts
+        with get_tracer().span("chat.route") as span:
+            routed = route_question(question, artifacts)
+            span.set("intent", routed[0] if routed else "llm")
+        if routed:
+            return routed[1]
+        
+        # A near-identical standalone question asked against the same artifacts gets the stored answer
+        if CHAT_CACHE_SIMILARITY <= 0 or not cacheable:
+            return None
+        hit = self.db.find_cached_answer(project_name, question, version, CHAT_CACHE_SIMILARITY)
+        return hit["answer"] if hit else None
+    
+    def _remember(self, question, response, history, memory_state):
+        # Fold turns leaving the verbatim window into the summary, after the answer is out
+        if memory_state is not None:
+            self.memory.update(
+                list(history or []) + [
+                    {"role": "user", "content": question},
+                    {"role": "assistant", "content": response}
+                ],
+                memory_state
+            )
+    
+    def _build_prompt(self, question, project_name, requirements, artifacts, history=None, memory_state=None):
         # Create context from project artifacts
         context = self._prepare_context(project_name, requirements, artifacts, question)  # Pass 'question' here
         
+        # Recent turns, the rolling summary and related earlier answers, in a fixed token budget
+        conversation = self.memory.context(project_name, question, history, memory_state)
+        
         # Create the prompt for the LLM
-        prompt = f"""
+        return f"""
 You are the Project Lead of an AI development pod working on the project "{project_name}".
 You have access to the following project information:
 
@@ -24,53 +140,52 @@ HIGH-LEVEL REQUIREMENTS:
 PROJECT ARTIFACTS SUMMARY:
 {context}
 
+CONVERSATION SO FAR:
+{conversation or "(this is the first question)"}
+
 A team member has asked you the following question:
 "{question}"
 
 Please respond to this question as the Project Lead. Be concise, informative, and accurate.
+Use the conversation so far to resolve follow-up questions and stay consistent with earlier answers.
 If the information is not available in the context, politely explain what information you have 
 and what might be needed to better answer the question.
 """
-        
-        # Get response from LLM
-        response = self.llm.get_response(prompt)
-        
-        # Store the conversation in the database
-        self.db.store_conversation(project_name, question, response)
-        
-        return response
     
     def _prepare_context(self, project_name, requirements, artifacts, question):
         """
-        Prepare context from project artifacts
+        Prepare context from project artifacts, packed into the chat context token budget
         """
-        context = []
+        builder = PromptBuilder(budget=CHAT_CONTEXT_TOKEN_BUDGET, reserve=0)
         
         # Add user stories summary
         if artifacts["user_stories"]:
             stories_summary = "\nUSER STORIES SUMMARY:\n"
             for i, story in enumerate(artifacts["user_stories"]):
-                stories_summary += f"- User Story #{i+1}: {story['title']} (As a {story['role']}, I want {story['want'][:50]}...)\n"
-            context.append(stories_summary)
+                stories_summary += f"- User Story #{i+1}: {story['title']} (As a {story['role']}, I want {story['want']})\n"
+            builder.add("stories", stories_summary, priority=2)
         
-        # Add design document summary
+        # Add the design document outline; the relevant passages are retrieved below
         if artifacts["design_doc"]:
-            design_preview = artifacts["design_doc"][:500] + "..." if len(artifacts["design_doc"]) > 500 else artifacts["design_doc"]
-            context.append(f"\nDESIGN DOCUMENT PREVIEW:\n{design_preview}")
+            builder.add(
+                "design",
+                f"\nDESIGN DOCUMENT OUTLINE:\n{summarize_markdown(artifacts['design_doc'])}",
+                priority=1
+            )
         
         # Add code summary
         if artifacts["code"]:
             code_summary = "\nCODE FILES:\n"
             for filename in artifacts["code"].keys():
                 code_summary += f"- {filename}\n"
-            context.append(code_summary)
+            builder.add("code", code_summary, priority=2)
         
         # Add test summary
         if artifacts["test_cases"]:
             test_summary = "\nTEST CASES SUMMARY:\n"
             for i, test in enumerate(artifacts["test_cases"]):
                 test_summary += f"- Test #{i+1}: {test['title']}\n"
-            context.append(test_summary)
+            builder.add("tests", test_summary, priority=2)
         
         # Add test results if available
         if artifacts["test_results"]:
@@ -90,18 +205,34 @@ and what might be needed to better answer the question.
                 for test in failed_tests:
                     results_summary += f"  - {test['title']}\n"
             
-            context.append(results_summary)
+            builder.add("results", results_summary, priority=3)
+        
+        # Retrieve the design and code chunks closest to the question
+        chunks = self.db.query_chunks(project_name, question, limit=CHAT_RETRIEVAL_TOP_K)
+        if chunks:
+            builder.add("chunks_header", "\nRELEVANT DESIGN AND CODE EXCERPTS:", priority=1)
+            # Ranked by similarity, so later chunks are degraded first
+            for i, chunk in enumerate(chunks):
+                builder.add(
+                    f"chunk:{i}",
+                    f"- {chunk['source'].capitalize()} {chunk['path']} "
+                    f"(lines {chunk['start_line']}-{chunk['end_line']}):\n{chunk['text']}",
+                    priority=1
+                )
         
-        # Query the database for relevant information
-        db_results = self.db.query_project_data(project_name, question)
+        # Projects indexed before chunking fall back to whole-document search
+        db_results = {} if chunks else self.db.query_project_data(project_name, question)
         if db_results:
-            relevant_info = "\nRELEVANT INFORMATION FROM DATABASE:\n"
+            builder.add("db_header", "\nRELEVANT INFORMATION FROM DATABASE:", priority=0)
             for category, data in db_results.items():
                 if data["documents"]:
-                    relevant_info += f"- From {category.upper()}:\n"
+                    # Hits are ranked by similarity, so later documents are degraded first
                     for i, doc in enumerate(data["documents"]):
-                        preview = doc[:200] + "..." if len(doc) > 200 else doc
-                        relevant_info += f"  Document {i+1}: {preview}\n"
-            context.append(relevant_info)
+                        builder.add(
+                            f"db:{category}:{i}",
+                            f"- From {category.upper()}, Document {i+1}:\n{doc}",
+                            priority=0
+                        )
         
-        return "\n".join(context)
+        packed = builder.build()
+        return "\n".join(text for text in packed.values() if text)
@@ -0,0 +1,227 @@
+import os
+import re
+import ast
+import json
+import functools
+import threading
+from utils.tracing import get_tracer
+
+# Input token budget for a single prompt (model context minus room for the completion)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "24000"))
+# Tokens kept free for the fixed instruction text around the packed sections
+PROMPT_TEMPLATE_RESERVE = int(os.getenv("PROMPT_TEMPLATE_RESERVE", "600"))
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    """
+    Load the model's tokenizer once per process.
+    Returns None when it cannot be loaded (offline, gated model) or TOKENIZER_NAME is "estimate",
+    in which case counts are estimated.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None and os.getenv("TOKENIZER_NAME", "").lower() == "estimate":
+                _tokenizer = False
+            elif _tokenizer is None:
+                try:
+                    from transformers import AutoTokenizer
+                    _tokenizer = AutoTokenizer.from_pretrained(
+                        os.getenv("TOKENIZER_NAME", os.getenv("MODEL_NAME", "mistralai/Mixtral-8x7B-Instruct-v0.1")),
+                        token=os.getenv("HUGGINGFACE_API_KEY")
+                    )
+                except Exception as e:
+                    print(f"Error loading tokenizer, estimating token counts: {str(e)}")
+                    _tokenizer = False
+    return _tokenizer or None
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        # Roughly four characters per token for English text and code
+        return len(text) // 4 + 1
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Keep as many whole lines of text as fit in max_tokens.
+    When not even the first line fits, it is cut at a character boundary instead.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    lines = text.splitlines()
+    low, high = 0, len(lines)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens("\n".join(lines[:mid]) + "\n[...]") <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    if low:
+        return "\n".join(lines[:low]) + "\n[...]"
+
+    first = lines[0] if lines else ""
+    low, high = 0, len(first)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(first[:mid] + " [...]") <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return first[:low] + " [...]" if low else ""
+
+
+def summarize_markdown(text):
+    """
+    Outline of a Markdown document: every heading plus the first line of its body
+    """
+    outline = []
+    take_next = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if re.match(r"^#{1,6}\s", stripped):
+            outline.append(stripped)
+            take_next = True
+        elif take_next and stripped:
+            outline.append(stripped)
+            take_next = False
+    return "\n".join(outline)
+
+
+def summarize_code(code):
+    """
+    Outline of a Python file: imports, class and function signatures and the first docstring line
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return "\n".join(
+            line for line in code.splitlines()
+            if re.match(r"^\s*(class |def |async def |import |from )", line)
+        )
+
+    lines = code.splitlines()
+    outline = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)) and node in tree.body:
+            outline.append((node.lineno, lines[node.lineno - 1].strip()))
+        elif isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            header = lines[node.lineno - 1].rstrip()
+            docstring = ast.get_docstring(node)
+            if docstring:
+                indent = len(header) - len(header.lstrip()) + 4
+                header += "\n" + " " * indent + '"""' + docstring.splitlines()[0] + '"""'
+            outline.append((node.lineno, header))
+    return "\n".join(text for _, text in sorted(outline))
+
+
+def format_stories(user_stories):
+    """
+    Full user story text shared by every agent prompt.
+    Memoised on the story content, so each project's stories are formatted once.
+    """
+    return _format_stories(json.dumps(user_stories, sort_keys=True))
+
+
+@functools.lru_cache(maxsize=32)
+def _format_stories(stories_json):
+    stories_text = ""
+    for i, story in enumerate(json.loads(stories_json)):
+        stories_text += f"User Story #{i+1}: {story['title']}\n"
+        stories_text += f"As a {story['role']}, I want {story['want']} so that {story['so_that']}\n"
+        stories_text += "Acceptance Criteria:\n"
+        for criterion in story['acceptance_criteria']:
+            stories_text += f"- {criterion}\n"
+        stories_text += "\n"
+    return stories_text
+
+
+def summarize_stories(user_stories):
+    """
+    One line per user story, without acceptance criteria
+    """
+    return "\n".join(
+        f"User Story #{i+1}: {story['title']} (As a {story['role']}, I want {story['want']})"
+        for i, story in enumerate(user_stories)
+    )
+
+
+class PromptSection:
+    def __init__(self, name, text, priority, summary=None):
+        self.name = name
+        self.text = text or ""
+        self.priority = priority
+        self.summary = summary
+
+
+class PromptBuilder:
+    """
+    Packs named prompt sections into a token budget.
+    When everything does not fit, sections are degraded from the lowest priority up:
+    first replaced by their summary, then cut at a line boundary, and finally dropped.
+    """
+
+    def __init__(self, budget=None, reserve=None):
+        self.budget = budget or PROMPT_TOKEN_BUDGET
+        self.reserve = PROMPT_TEMPLATE_RESERVE if reserve is None else reserve
+        self.sections = []
+
+    def add(self, name, text, priority=0, summary=None):
+        """
+        summary is an alternative shorter text, or a function producing one from text
+        """
+        self.sections.append(PromptSection(name, text, priority, summary))
+        return self
+
+    def build(self):
+        """
+        Return {section name: packed text}
+        """
+        with get_tracer().span("prompt.build", sections=len(self.sections), budget=self.budget) as span:
+            packed, tokens = self._pack()
+            span.set("prompt_tokens", sum(tokens.values()))
+            span.set("degraded", sum(
+                1 for section in self.sections if packed[section.name] != section.text
+            ))
+        return packed
+
+    def _pack(self):
+        available = max(0, self.budget - self.reserve)
+        packed = {section.name: section.text for section in self.sections}
+        tokens = {section.name: count_tokens(section.text) for section in self.sections}
+
+        # Lowest priority first; later sections go first among equals
+        degrade_order = sorted(
+            reversed(self.sections), key=lambda section: section.priority
+        )
+
+        # Pass 1: summaries
+        for section in degrade_order:
+            if sum(tokens.values()) <= available:
+                return packed, tokens
+            if section.summary is None:
+                continue
+            summary = section.summary(section.text) if callable(section.summary) else section.summary
+            summary_tokens = count_tokens(summary)
+            if summary_tokens < tokens[section.name]:
+                packed[section.name] = summary
+                tokens[section.name] = summary_tokens
+
+        # Pass 2: cut, then drop
+        for section in degrade_order:
+            overflow = sum(tokens.values()) - available
+            if overflow <= 0:
+                break
+            keep = tokens[section.name] - overflow
+            packed[section.name] = truncate_to_tokens(packed[section.name], keep) if keep > 0 else ""
+            tokens[section.name] = count_tokens(packed[section.name])
+
+        return packed, tokens
+
@@ -0,0 +1,53 @@
+import os
+import threading
+
+# Process-wide instances shared by every Streamlit session and worker thread
+_instances = {}
+_lock = threading.RLock()
+
+
+def get_shared(key, factory):
+    """
+    Return the instance registered under key, building it with factory() on first use
+    """
+    instance = _instances.get(key)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(key)
+            if instance is None:
+                instance = factory()
+                _instances[key] = instance
+    return instance
+
+
+def get_llm_handler():
+    from utils.conversation import LLMHandler
+    return get_shared("llm_handler", LLMHandler)
+
+
+def get_db_manager():
+    from utils.database import ChromaManager
+    return get_shared("db_manager", ChromaManager)
+
+
+def get_job_queue():
+    from utils.jobs import JobQueue
+    return get_shared("job_queue", lambda: JobQueue(
+        os.getenv("JOB_DB_PATH", os.path.join(os.getenv("CHROMA_DB_PATH", "./data"), "jobs.sqlite3"))
+    ))
+
+
+def get_agent(agent_class):
+    """
+    Return the shared instance of an agent class (BusinessAnalyst, DesignAgent, Developer, Tester, ProjectLead).
+    Agents keep no per-project state, so one instance per process can serve every session.
+    """
+    return get_shared(f"agent:{agent_class.__module__}.{agent_class.__name__}", agent_class)
+
+
+def reset():
+    """
+    Drop all shared instances so the next lookup rebuilds them
+    """
+    with _lock:
+        _instances.clear()
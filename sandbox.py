@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import shutil
+import signal
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from utils.chunking import extract_code
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; only the wall-clock timeout applies there
+    resource = None
+
+# Limits applied to every pytest worker process; the timeout applies to each test on its own
+TEST_WORKERS = int(os.getenv("TEST_WORKERS", str(os.cpu_count() or 1)))
+TEST_TIMEOUT_SECONDS = float(os.getenv("TEST_TIMEOUT_SECONDS", "60"))
+TEST_CPU_SECONDS = int(os.getenv("TEST_CPU_SECONDS", "30"))
+TEST_MEMORY_MB = int(os.getenv("TEST_MEMORY_MB", "1024"))
+# Extra wall-clock time a shard gets for interpreter start-up and collection
+SHARD_STARTUP_SECONDS = float(os.getenv("SHARD_STARTUP_SECONDS", "30"))
+
+# Sets the CPU and address-space limits in the child interpreter, then execs pytest in its place.
+# Used instead of preexec_fn, which is not safe to use from the threads of the Streamlit server.
+LIMITED_PYTEST = (
+    "import os, sys, resource\n"
+    "cpu, memory = int(sys.argv[1]), int(sys.argv[2])\n"
+    "resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))\n"
+    "resource.setrlimit(resource.RLIMIT_AS, (memory, memory))\n"
+    "os.execv(sys.executable, [sys.executable, '-m', 'pytest'] + sys.argv[3:])\n"
+)
+
+# pytest plugin loaded into every shard. It fails a test that runs past the timeout without
+# stopping the rest of the shard, and appends each test's outcome to a file as it finishes,
+# so results survive even when the whole shard has to be killed.
+SANDBOX_PLUGIN = """
+import os, json, signal, pytest
+
+TIMEOUT = float(os.environ["SANDBOX_TEST_TIMEOUT"])
+RESULTS = os.environ["SANDBOX_RESULTS"]
+
+
+def _record(test_id, status, details=""):
+    with open(RESULTS, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"id": test_id, "status": status, "details": details}) + "\\n")
+
+
+def _timed_out(signum, frame):
+    pytest.fail(f"Timed out after {TIMEOUT:.0f}s", pytrace=False)
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    _record(item.nodeid, None)
+    alarm = hasattr(signal, "setitimer")
+    if alarm:
+        signal.signal(signal.SIGALRM, _timed_out)
+        signal.setitimer(signal.ITIMER_REAL, TIMEOUT)
+    try:
+        yield
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def pytest_runtest_logreport(report):
+    if report.failed:
+        _record(report.nodeid, "FAIL", report.longreprtext[-1500:])
+    elif report.skipped:
+        reason = report.longrepr[2] if isinstance(report.longrepr, tuple) else "Skipped"
+        _record(report.nodeid, "NOT RUN", reason)
+    elif report.when == "call":
+        _record(report.nodeid, "PASS")
+"""
+
+
+def _kill_process_group(process):
+    # pytest runs in its own session, so this also reaches processes the tests started
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+    elif process.poll() is None:
+        process.kill()
+
+
+class SandboxRunner:
+    """
+    Runs generated pytest files against generated code in a throwaway workspace.
+    Tests are sharded across worker processes, each with its own CPU and memory limits and an
+    environment stripped of the parent's secrets; every test has its own time limit.
+    Only the environment is isolated: the tests can still reach the network and any file the
+    server user can access, so generated code is not sandboxed beyond these limits.
+    """
+
+    def __init__(self, workers=None, timeout=None):
+        self.workers = max(1, workers or TEST_WORKERS)
+        self.timeout = timeout or TEST_TIMEOUT_SECONDS
+
+    def run(self, code_files, test_files, test_ids):
+        """
+        Write code_files and test_files ({filename: source}) to a temp workspace and run test_ids
+        ("test_file.py::test_name" node ids). Returns {node id: {"status": ..., "details": ...}}
+        with status PASS, FAIL or NOT RUN.
+        """
+        workspace = tempfile.mkdtemp(prefix="genai_sandbox_")
+        try:
+            for filename, source in list(code_files.items()) + list(test_files.items()):
+                self._write(workspace, filename, source)
+            with open(os.path.join(workspace, "_sandbox_plugin.py"), "w", encoding="utf-8") as f:
+                f.write(SANDBOX_PLUGIN)
+
+            shards = [test_ids[i::self.workers] for i in range(self.workers)]
+            shards = [shard for shard in shards if shard]
+            results = {}
+            with ThreadPoolExecutor(max_workers=max(1, len(shards))) as executor:
+                for shard_results in executor.map(
+                    lambda args: self._run_shard(workspace, *args), enumerate(shards)
+                ):
+                    results.update(shard_results)
+            return results
+        finally:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    def _write(self, workspace, filename, source):
+        # Generated filenames must stay inside the workspace
+        path = os.path.normpath(os.path.join(workspace, filename))
+        if os.path.isabs(filename) or not path.startswith(workspace + os.sep):
+            print(f"Skipping file outside the sandbox workspace: {filename}")
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(extract_code(source) if filename.endswith(".py") else source)
+
+    def _environment(self, workspace, results):
+        env = {
+            "PATH": os.environ.get("PATH", ""),
+            "HOME": workspace,
+            "TMPDIR": workspace,
+            "PYTHONPATH": workspace,
+            "PYTHONDONTWRITEBYTECODE": "1",
+            "PYTHONHASHSEED": "0",
+            "SANDBOX_TEST_TIMEOUT": str(self.timeout),
+            "SANDBOX_RESULTS": results
+        }
+        if "SYSTEMROOT" in os.environ:
+            env["SYSTEMROOT"] = os.environ["SYSTEMROOT"]
+        return env
+
+    def _run_shard(self, workspace, index, test_ids):
+        results_file = os.path.join(workspace, f".results-{index}.jsonl")
+        pytest_args = ["-q", "-p", "no:cacheprovider", "-p", "_sandbox_plugin", *test_ids]
+        if resource:
+            command = [
+                sys.executable, "-c", LIMITED_PYTEST,
+                str(TEST_CPU_SECONDS), str(TEST_MEMORY_MB * 1024 * 1024), *pytest_args
+            ]
+        else:
+            command = [sys.executable, "-m", "pytest", *pytest_args]
+
+        process = subprocess.Popen(
+            command,
+            cwd=workspace,
+            env=self._environment(workspace, results_file),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            start_new_session=True
+        )
+        # Backstop for a test the per-test alarm cannot interrupt (blocked in C code, or no SIGALRM)
+        shard_timeout = self.timeout * len(test_ids) + SHARD_STARTUP_SECONDS
+        timed_out = False
+        try:
+            stdout, stderr = process.communicate(timeout=shard_timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            _kill_process_group(process)
+            stdout, stderr = process.communicate()
+        finally:
+            # Processes left behind by the tests are stopped with the shard
+            _kill_process_group(process)
+
+        results, unfinished = self._read_results(results_file)
+        if timed_out:
+            stopped = {"status": "NOT RUN", "details": "Not run: an earlier test in its shard hung"}
+            hung = {"status": "FAIL", "details": f"Timed out after {shard_timeout:.0f}s, stopping its shard"}
+            return {
+                test_id: results.get(test_id) or (hung if test_id in unfinished else stopped)
+                for test_id in test_ids
+            }
+
+        output_tail = (stdout + stderr).strip()[-1500:]
+        return {
+            test_id: results.get(test_id) or {
+                "status": "FAIL",
+                "details": f"pytest exited with code {process.returncode} without reporting this test:\n{output_tail}"
+            }
+            for test_id in test_ids
+        }
+
+    def _read_results(self, results_file):
+        # Returns ({node id: result} for finished tests, node ids started but never finished).
+        # Each test has a line per setup/call/teardown report; a failure in any phase fails it.
+        reports = {}
+        if os.path.exists(results_file):
+            with open(results_file, encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    reports.setdefault(record["id"], []).append(record)
+
+        results, unfinished = {}, set()
+        for test_id, records in reports.items():
+            by_status = {}
+            for record in records:
+                if record["status"]:
+                    by_status.setdefault(record["status"], record)
+            outcome = by_status.get("FAIL") or by_status.get("NOT RUN") or by_status.get("PASS")
+            if outcome:
+                results[test_id] = {"status": outcome["status"], "details": outcome["details"]}
+            else:
+                unfinished.add(test_id)
+        return results, unfinished
+        with open(results_file, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                current = results.get(record["id"])
+                if record["status"] is None:
+                    # Started but not finished: only the shard timeout can leave this in place
+                    results[record["id"]] = {
+                        "status": "FAIL",
+                        "details": f"Timed out after {self.timeout:.0f}s and stopped the rest of its shard"
+                    }
+                elif current is None or current["status"] != "FAIL" and record["status"] != "PASS":
+                    results[record["id"]] = {"status": record["status"], "details": record["details"]}
+                elif current["details"].startswith("Timed out after") and current["status"] == "FAIL":
+                    results[record["id"]] = {"status": record["status"], "details": record["details"]}
+        return results
@@ -0,0 +1,38 @@
+# [Module Name]
+# Description: [Description]
+# Author: AI Development Pod
+# Created: [Date]
+
+# Imports
+import [module]
+
+# Constants
+[CONSTANTS]
+
+# Classes
+class [ClassName]:
+    """
+    [Class description]
+    """
+    
+    def __init__(self):
+        """
+        Initialize the class
+        """
+        pass
+    
+    def [method_name](self):
+        """
+        [Method description]
+        """
+        pass
+
+# Main function
+def main():
+    """
+    Main function
+    """
+    pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# Finished spans kept in memory for the sidebar panel and exports
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "5000"))
+# Optional file every finished span is appended to as one JSON line
+TRACE_JSONL_PATH = os.getenv("TRACE_JSONL_PATH", "")
+
+# Numeric span attributes that are summed per span name in summaries and metrics
+COUNTED_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "prompt_bytes", "completion_bytes", "items", "bytes")
+
+_current_project = contextvars.ContextVar("trace_project", default="")
+_current_span = contextvars.ContextVar("trace_span", default=None)
+
+
+def set_project(project_name):
+    """
+    Tag spans started in this context (and in worker threads started with propagate) with a project
+    """
+    _current_project.set(project_name or "")
+
+
+def propagate(fn):
+    """
+    Wrap fn so it runs in a copy of the caller's context when submitted to a thread pool
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+class Span:
+    def __init__(self, tracer, name, attributes, activate):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent else None
+        self.project = _current_project.get()
+        self.attributes = dict(attributes)
+        self.error = None
+        self.start_time = time.time()
+        self.duration_ms = None
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self) if activate else None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+        return self
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self._start) * 1000
+
+    def add(self, key, amount=1):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+        return self
+
+    def finish(self, error=None):
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+        if error is not None:
+            self.error = f"{type(error).__name__}: {str(error)}"[:300]
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                # Finished from another context (e.g. a generator consumed elsewhere)
+                pass
+        self.tracer._record(self)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "project": self.project,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration_ms or 0, 3),
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+
+class Tracer:
+    """
+    Lightweight in-process tracer. Spans are kept in a bounded ring buffer and can be
+    summarised per project, exported as JSON lines or as Prometheus text metrics.
+    """
+
+    def __init__(self, buffer_size=None, jsonl_path=None):
+        self.spans = deque(maxlen=buffer_size or TRACE_BUFFER_SIZE)
+        self.jsonl_path = TRACE_JSONL_PATH if jsonl_path is None else jsonl_path
+        self._lock = threading.Lock()
+
+    def start(self, name, activate=True, **attributes):
+        """
+        Start a span that the caller finishes. Pass activate=False for spans kept open across
+        generator yields, so they do not become the parent of unrelated spans.
+        """
+        return Span(self, name, attributes, activate)
+
+    @contextmanager
+    def span(self, name, activate=True, **attributes):
+        span = self.start(name, activate=activate, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.finish(error=e)
+            raise
+        span.finish()
+
+    def _record(self, span):
+        with self._lock:
+            self.spans.append(span)
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(span.to_dict()) + "\n")
+
+    def finished(self, project=None):
+        with self._lock:
+            spans = list(self.spans)
+        if project is not None:
+            spans = [span for span in spans if span.project == project]
+        return spans
+
+    def summary(self, project=None):
+        """
+        Per span name: calls, errors, total/mean/p95 milliseconds, cache hits and summed counters
+        """
+        grouped = {}
+        for span in self.finished(project):
+            grouped.setdefault(span.name, []).append(span)
+
+        rows = []
+        for name, spans in sorted(grouped.items()):
+            durations = sorted(span.duration_ms for span in spans)
+            row = {
+                "span": name,
+                "calls": len(spans),
+                "errors": sum(1 for span in spans if span.error),
+                "total_ms": round(sum(durations), 1),
+                "mean_ms": round(sum(durations) / len(durations), 1),
+                "p95_ms": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))], 1),
+                "cache_hits": sum(1 for span in spans if span.attributes.get("cache_hit"))
+            }
+            for key in COUNTED_ATTRIBUTES:
+                values = [span.attributes[key] for span in spans if isinstance(span.attributes.get(key), (int, float))]
+                if values:
+                    row[key] = sum(values)
+            rows.append(row)
+        return rows
+
+    def export_jsonl(self, project=None):
+        return "".join(json.dumps(span.to_dict()) + "\n" for span in self.finished(project))
+
+    def export_prometheus(self, project=None):
+        """
+        Prometheus text exposition of span counts, durations and counters, labelled by span and project
+        """
+        metrics = ["calls", "errors", "duration_seconds", "cache_hits"] + list(COUNTED_ATTRIBUTES)
+        totals = {}
+        for span in self.finished(project):
+            labels = f'span="{_escape(span.name)}",project="{_escape(span.project)}"'
+            values = {
+                "calls": 1,
+                "errors": 1 if span.error else 0,
+                "duration_seconds": span.duration_ms / 1000,
+                "cache_hits": 1 if span.attributes.get("cache_hit") else 0
+            }
+            for key in COUNTED_ATTRIBUTES:
+                if isinstance(span.attributes.get(key), (int, float)):
+                    values[key] = span.attributes[key]
+            for metric, value in values.items():
+                totals[(metric, labels)] = totals.get((metric, labels), 0) + value
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# TYPE genai_span_{metric}_total counter")
+            for (name, labels), value in sorted(totals.items()):
+                if name == metric:
+                    lines.append(f"genai_span_{metric}_total{{{labels}}} {round(value, 6)}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    return _tracer